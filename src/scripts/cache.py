@@ -0,0 +1,219 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+import uuid
+
+import numpy as np
+
+from .vector import VectorImage
+
+
+# Bump whenever a change to rendering alters the output for the same
+# request, so stale on-disk entries are never served
+CACHE_VERSION = 4
+
+
+def _plain(value):
+    # Exact JSON-ready copy of request data. Anything else, such as a
+    # function, raises TypeError, as its text form would not identify it.
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return _plain(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError(f"Cannot identify {type(value).__name__} in a cache key")
+
+
+def image_fingerprint(img):
+    """
+    Digest of an image's content: its pixels, or for a VectorImage its
+    shapes. Equal for equal images, whatever object holds them.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    # Vector images are identified by their shapes rather than pixels
+    if isinstance(img, VectorImage):
+        digest.update(json.dumps(img.spec(), sort_keys=True).encode())
+    else:
+        digest.update(json.dumps([img.mode, list(img.size)]).encode())
+        digest.update(np.ascontiguousarray(np.asarray(img)).data)
+
+    return digest.hexdigest()
+
+
+def request_key(cache, img, mode, seed, output_path, **options):
+    """
+    Key identifying one render request, or None when it cannot be cached:
+    without a cache, without a seed, as unseeded renders are random, or
+    with options that have no exact plain form (e.g. functions).
+    """
+    if cache is None or seed is None:
+        return None
+
+    try:
+        meta = json.dumps(_plain({
+            "version": CACHE_VERSION,
+            "mode": mode,
+            "seed": seed,
+            "format": Path(output_path).suffix.lower(),
+            "options": options,
+            "image": image_fingerprint(img),
+        }), sort_keys=True)
+    except TypeError:
+        return None
+
+    return hashlib.sha256(meta.encode()).hexdigest()
+
+
+class RenderCache:
+    """
+    Cache of encoded render outputs, keyed by `request_key`.
+
+    Entries live in memory, up to `max_bytes`, and, when `directory` is
+    given, on disk, up to `disk_max_bytes`. Each tier evicts its least
+    recently used entries once over budget; disk hits are promoted back into
+    memory. Hit, miss and eviction counts are kept in `stats`.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None, disk_max_bytes=2 * 2**30):
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.directory = Path(directory) if directory is not None else None
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "evictions": 0,
+        }
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(p.stat().st_size for p in self._disk_entries())
+
+    # -------------------------
+    # Tiers
+    # -------------------------
+    def _disk_path(self, key):
+        return self.directory / key[:2] / key
+
+    def _disk_entries(self):
+        return [p for p in self.directory.glob("??/*") if not p.name.startswith(".")]
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _write_disk(self, key, data):
+        if len(data) > self.disk_max_bytes:
+            return
+
+        path = self._disk_path(key)
+        path.parent.mkdir(exist_ok=True)
+        if path.exists():
+            self._disk_bytes -= path.stat().st_size
+
+        tmp = path.with_name(f".{key}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        self._disk_bytes += len(data)
+
+        if self._disk_bytes > self.disk_max_bytes:
+            # Access times are kept in mtime, refreshed on every hit
+            entries = sorted(self._disk_entries(), key=lambda p: p.stat().st_mtime)
+            for old in entries:
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+                if old == path:
+                    continue
+                try:
+                    size = old.stat().st_size
+                    old.unlink()
+                except FileNotFoundError:
+                    continue
+                self._disk_bytes -= size
+                self.stats["evictions"] += 1
+
+    # -------------------------
+    # Public interface
+    # -------------------------
+    def get(self, key):
+        """Return the cached bytes for `key`, or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return data
+
+            if self.directory is not None:
+                path = self._disk_path(key)
+                try:
+                    data = path.read_bytes()
+                    os.utime(path)
+                except FileNotFoundError:
+                    data = None
+
+                if data is not None:
+                    self._remember(key, data)
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return data
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+            if self.directory is not None:
+                self._write_disk(key, data)
+
+    def restore(self, key, output_path):
+        """Write the cached output for `key` to `output_path`; return whether it was cached."""
+        data = self.get(key)
+        if data is None:
+            return False
+        Path(output_path).write_bytes(data)
+        return True
+
+    def store(self, key, output_path):
+        """Cache the encoded output just saved to `output_path`."""
+        self.put(key, Path(output_path).read_bytes())
+
+    def size(self):
+        return {"memory": self._memory_bytes, "disk": self._disk_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self.directory is not None:
+                for path in self._disk_entries():
+                    path.unlink(missing_ok=True)
+                self._disk_bytes = 0
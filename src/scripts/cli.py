@@ -1,12 +1,18 @@
 import argparse
 from importlib.resources import files
+import json
 from PIL import Image
+import numpy as np
 
-from . import red_blue, red_green, red_grey, flexible
+from . import red_blue, red_green, red_grey, flexible, cost
+from .dots import mode_layers
+from .cache import RenderCache
+from .vector import VectorImage
+from .workqueue import WorkQueue, run_worker
 
 
 # --------------------------------------------------
-# Default input images
+# Default input and output images
 # --------------------------------------------------
 
 DEFAULT_INPUTS = {
@@ -17,12 +23,35 @@ DEFAULT_INPUTS = {
 }
 
 
+DEFAULT_OUTPUTS = {
+    "red-blue": "redblue.png",
+    "red-green": "redgreen.png",
+    "red-grey": "redgrey.png",
+    "flexible": "orangeyellow.png"
+}
+
+
+MODULES = {
+    "red-blue": red_blue,
+    "red-green": red_green,
+    "red-grey": red_grey,
+    "flexible": flexible,
+}
+
+
 def load_default_image(mode):
     return Image.open(
         files("src.scripts.default_input") / DEFAULT_INPUTS[mode]
     ).convert("RGB")
 
 
+def load_image(path):
+    # SVG inputs stay vector shapes, so their edges are exact
+    if str(path).lower().endswith(".svg"):
+        return VectorImage.from_svg(path)
+    return Image.open(path).convert("RGB")
+
+
 # --------------------------------------------------
 # Argument helpers
 # --------------------------------------------------
@@ -74,50 +103,60 @@ def add_colour2_args(parser):
     parser.add_argument(f"--colour2_ratio", type=float, metavar="", default=0.75, help="Ratio of small:large coloured dots")
     parser.add_argument(f"--colour2_shape", choices=["circle", "square"], default="square", help="Shape of the coloured dots")
 
-# --------------------------------------------------
-# CLI entry point
-# --------------------------------------------------
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Chromostereopsis stimulus generator",
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        add_help=False
-    )
+def add_render_args(parser):
+    parser.add_argument("--scale", type=int, metavar="", default=3, help="Supersampling factor of the drawing canvas")
+    parser.add_argument("--resample", choices=["lanczos", "box"], default="lanczos", help="Filter used to downsample the canvas")
 
-    parser.add_argument(
-    "--help",
-    action="help",
-    help="Help for CLI"
-)
-    
-    subparsers = parser.add_subparsers(dest="mode", required=True)
 
+def add_run_args(parser):
+    parser.add_argument("--seed", type=int, metavar="", default=None, help="Random seed, for a reproducible dot layout")
+    parser.add_argument("--variant", type=int, metavar="", default=0, help="Index of the variant of the seed to render")
+    parser.add_argument("--cache", metavar="", default=None, help="Directory of an on-disk cache of seeded renders")
+    parser.add_argument("--queue", metavar="", default=None, help="Submit the render to this work queue directory instead of running it")
+
+
+# --------------------------------------------------
+# Illusion subcommands
+# --------------------------------------------------
+
+def add_mode_parsers(subparsers, run=True):
+    # Without `run`, the parsers only describe a render (for estimate)
+    # and take no seed, cache or queue
     # ---------------- RED-BLUE ----------------
     rb = subparsers.add_parser("red-blue", help="RED-BLUE chromostereopsis", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     rb.add_argument("--input", metavar="", default=None, help="Path of the chosen input image")
-    rb.add_argument("--save", metavar="", default="redblue.png", help="Save name/path of the output image")
+    rb.add_argument("--save", metavar="", default=None, help="Save name/path of the output image (named after the illusion by default, or after the job id when queued)")
     add_red_args(rb)
     add_blue_args(rb)
+    add_render_args(rb)
+    if run:
+        add_run_args(rb)
 
     # ---------------- RED-GREEN ----------------
     rg = subparsers.add_parser("red-green", help="RED-GREEN chromostereopsis", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     rg.add_argument("--input", metavar="", default=None, help="Path of the chosen input image")
-    rg.add_argument("--save", metavar="", default="redgreen.png", help="Save name/path of the output image")
+    rg.add_argument("--save", metavar="", default=None, help="Save name/path of the output image (named after the illusion by default, or after the job id when queued)")
     add_red_args(rg)
     add_green_args(rg)
+    add_render_args(rg)
+    if run:
+        add_run_args(rg)
 
     # ---------------- RED-GREY ----------------
     rgr = subparsers.add_parser("red-grey", help="RED-GREY chromostereopsis", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     rgr.add_argument("--input", metavar="", default=None, help="Path of the chosen input image")
-    rgr.add_argument("--save", metavar="", default="redgrey.png", help="Save name/path of the output image")
+    rgr.add_argument("--save", metavar="", default=None, help="Save name/path of the output image (named after the illusion by default, or after the job id when queued)")
     add_red_args(rgr)
     add_grey_args(rgr)
+    add_render_args(rgr)
+    if run:
+        add_run_args(rgr)
 
     # ---------------- FLEXIBLE ----------------
     flex = subparsers.add_parser("flexible", help="FLEXIBLE chromostereopsis", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     flex.add_argument("--input", metavar="", default=None, help="Path of the chosen input image")
-    flex.add_argument("--save", metavar="", default="orangeyellow.png", help="Save name/path of the output image")
+    flex.add_argument("--save", metavar="", default=None, help="Save name/path of the output image (named after the illusion by default, or after the job id when queued)")
 
     flex.add_argument("--colour1", type=str, metavar="", default="#FF8C00", help="HEX colour 1")
     flex.add_argument("--colour2", type=str, metavar="", default="#FFFF00", help="HEX colour 2")
@@ -125,24 +164,137 @@ def main():
 
     add_colour1_args(flex)
     add_colour2_args(flex)
+    add_render_args(flex)
+    if run:
+        add_run_args(flex)
+
+    return [rb, rg, rgr, flex]
+
+
+def add_estimate_args(parser):
+    parser.add_argument("--width", type=int, metavar="", default=None, help="Width of the input, instead of measuring an input image")
+    parser.add_argument("--height", type=int, metavar="", default=None, help="Height of the input, instead of measuring an input image")
+    parser.add_argument("--occupancy", type=float, nargs="+", metavar="", default=None, help="Fraction of the input covered by each colour, in drawing order (with --width/--height)")
+    parser.add_argument("--memory_budget", metavar="", default=None, help="Peak memory allowed, e.g. 512M or 4G")
+    parser.add_argument("--time_budget", type=float, metavar="", default=None, help="Runtime allowed, in seconds")
+    parser.add_argument("--model", metavar="", default=None, help="Cost model JSON file written by --calibrate")
+    parser.add_argument("--calibrate", metavar="", default=None, help="Measure the cost model on this machine and save it to this JSON file")
+
+
+def parse_bytes(text):
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def run_estimate(args, mode, options):
+    layer_options = {k: v for k, v in options.items() if k not in ("scale", "resample")}
+
+    if args.calibrate:
+        model = cost.calibrate()
+        with open(args.calibrate, "w") as f:
+            json.dump(model, f, indent=2)
+        print(f"Saved cost model to: {args.calibrate}")
+    elif args.model:
+        model = cost.load_model(args.model)
+    else:
+        model = None
+
+    if args.width and args.height:
+        width, height = args.width, args.height
+        # The layers of a 1x1 image give the dot dicts in drawing order
+        dots = [d for _, _, d in mode_layers(np.zeros((1, 1, 3), dtype=np.uint8), mode, **layer_options)]
+        occupancy = args.occupancy or [0.25] * len(dots)
+        if len(occupancy) != len(dots):
+            raise SystemExit(f"--occupancy needs {len(dots)} values")
+        layers = [dict(d, occupancy=o) for d, o in zip(dots, occupancy)]
+    else:
+        if args.input:
+            img = load_image(args.input)
+        else:
+            img = load_default_image(mode)
+        width, height = img.size
+        layers = cost.layer_stats(img, mode, **layer_options)
+
+    result, advice = cost.recommend(
+        width,
+        height,
+        layers,
+        scale=args.scale,
+        resample=args.resample,
+        mode=mode,
+        model=model,
+        memory_budget=parse_bytes(args.memory_budget) if args.memory_budget else None,
+        time_budget=args.time_budget,
+    )
+
+    print(f"{mode} at {width}x{height}, scale={args.scale}, resample={args.resample}")
+    for stage, seconds, memory in result["stages"]:
+        print(f"  {stage:<12}{seconds:>9.2f} s{memory / 2**20:>10.0f} MB")
+    print(f"  {'total':<12}{result['seconds']:>9.2f} s{result['peak_memory'] / 2**20:>10.0f} MB peak")
+
+    for line in advice:
+        print(line)
+
+
+# --------------------------------------------------
+# CLI entry point
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Chromostereopsis stimulus generator",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        add_help=False
+    )
+
+    parser.add_argument(
+    "--help",
+    action="help",
+    help="Help for CLI"
+)
     
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    add_mode_parsers(subparsers)
+
+    # ---------------- ESTIMATE ----------------
+    est = subparsers.add_parser("estimate", help="Predict the runtime and peak memory of a render", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    est_modes = est.add_subparsers(dest="estimate_mode", required=True)
+    for est_mode in add_mode_parsers(est_modes, run=False):
+        add_estimate_args(est_mode)
+
+    # ---------------- WORKER ----------------
+    worker = subparsers.add_parser("worker", help="Render jobs from a shared work queue", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    worker.add_argument("--queue", metavar="", required=True, help="Work queue directory, on a filesystem shared by all workers")
+    worker.add_argument("--lease", type=float, metavar="", default=60.0, help="Seconds without a heartbeat before a job is retried")
+    worker.add_argument("--max_attempts", type=int, metavar="", default=3, help="Attempts per job before it is marked as failed")
+    worker.add_argument("--poll", type=float, metavar="", default=1.0, help="Seconds between checks of an empty queue")
+    worker.add_argument("--max_jobs", type=int, metavar="", default=None, help="Stop after handling this many jobs")
+    worker.add_argument("--exit_when_idle", action="store_true", help="Stop once no jobs are pending or being rendered")
 
     args = parser.parse_args()
 
-    # --------------------------------------------------
-    # Resolve input image
-    # --------------------------------------------------
+    if args.mode == "worker":
+        run_worker(
+            args.queue,
+            lease=args.lease,
+            max_attempts=args.max_attempts,
+            poll=args.poll,
+            max_jobs=args.max_jobs,
+            exit_when_idle=args.exit_when_idle,
+        )
+        return
 
-    if args.input:
-        img = Image.open(args.input).convert("RGB")
-    else:
-        img = load_default_image(args.mode)
+    mode = args.estimate_mode if args.mode == "estimate" else args.mode
 
     # --------------------------------------------------
-    # Dispatch to rendering scripts
+    # Collect rendering options
     # --------------------------------------------------
 
-    if args.mode == "red-blue":
+    if mode == "red-blue":
         red_dots = dict(
             radius=args.red_radius,
             density=args.red_density,
@@ -159,14 +311,14 @@ def main():
             shape=args.blue_shape,
         )
 
-        red_blue.generate(
-            img=img,
-            output_path=args.save,
+        options = dict(
             red_dots=red_dots,
             blue_dots=blue_dots,
+            scale=args.scale,
+            resample=args.resample,
         )
 
-    elif args.mode == "red-green":
+    elif mode == "red-green":
         red_dots = dict(
             radius=args.red_radius,
             density=args.red_density,
@@ -183,14 +335,14 @@ def main():
             shape=args.green_shape,
         )
 
-        red_green.generate(
-            img=img,
-            output_path=args.save,
+        options = dict(
             red_dots=red_dots,
             green_dots=green_dots,
+            scale=args.scale,
+            resample=args.resample,
         )
 
-    elif args.mode == "red-grey":
+    elif mode == "red-grey":
         red_dots = dict(
             radius=args.red_radius,
             density=args.red_density,
@@ -208,14 +360,14 @@ def main():
             shape=args.grey_shape,
         )
 
-        red_grey.generate(
-            img=img,
-            output_path=args.save,
+        options = dict(
             red_dots=red_dots,
             grey_dots=grey_dots,
+            scale=args.scale,
+            resample=args.resample,
         )
 
-    elif args.mode == "flexible":
+    elif mode == "flexible":
 
         dots1 = dict(
             radius=args.colour1_radius,
@@ -233,12 +385,46 @@ def main():
             shape=args.colour2_shape,
         )
 
-        flexible.generate(
-            img=img,
-            output_path=args.save,
+        options = dict(
             colour1=args.colour1,
             colour2=args.colour2,
             dots1=dots1,
             dots2=dots2,
             tolerance=args.tolerance,
-        )
\ No newline at end of file
+            scale=args.scale,
+            resample=args.resample,
+        )
+
+    if args.mode == "estimate":
+        run_estimate(args, mode, options)
+        return
+
+    options.update(seed=args.seed, variant=args.variant)
+
+    # --------------------------------------------------
+    # Queue the render, or run it here
+    # --------------------------------------------------
+
+    # Without --save, queued results are named after their job, so they
+    # cannot overwrite each other
+    if args.queue:
+        job_id = WorkQueue(args.queue).submit(
+            args.mode,
+            output=args.save,
+            input=args.input,
+            **options,
+        )
+        print(f"Queued job: {job_id}")
+        return
+
+    if args.input:
+        img = load_image(args.input)
+    else:
+        img = load_default_image(args.mode)
+
+    MODULES[args.mode].generate(
+        img=img,
+        output_path=args.save or DEFAULT_OUTPUTS[args.mode],
+        cache=RenderCache(directory=args.cache) if args.cache else None,
+        **options,
+    )
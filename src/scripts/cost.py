@@ -0,0 +1,320 @@
+from io import BytesIO
+import json
+import math
+import time
+
+from PIL import Image, ImageDraw
+import numpy as np
+
+from .dots import (
+    DOT_DTYPE,
+    LABEL_BAND_PIXELS,
+    CounterRNG,
+    _dist_cap,
+    _downsample,
+    _place_dots,
+    _place_labelled,
+    _render_dots,
+    distance_field,
+    mode_layers,
+)
+from .predict import predict_layer
+
+
+# --------------------------------------------------
+# Cost model
+# --------------------------------------------------
+# Seconds per unit of work, as measured by `calibrate()` on a typical
+# desktop machine. Units are input pixels unless noted otherwise.
+DEFAULT_MODEL = {
+    "mask": 7.0e-9,         # per pixel and layer
+    "dist_scan": 4.5e-9,    # per pixel and layer
+    "edt": 2.5e-8,          # per pixel of the windows around edge tiles
+    "cell": 4.0e-6,         # per cell visited
+    "dot": 1.5e-5,          # per non-empty cell
+    "labelled": 4.0e-8,     # per labelled pixel, placed by the layered engine
+    "draw": 2.5e-6,         # per dot drawn
+    "fill": 2.0e-8,         # per canvas pixel covered by dots
+    "canvas": 4.0e-10,      # per canvas pixel allocated
+    "lanczos": 2.0e-8,      # per canvas pixel
+    "box": 1.5e-9,          # per canvas pixel
+    "encode": 1.0e-7,       # per output pixel
+}
+
+# Bytes per input pixel held by each kind of buffer. PIL keeps RGB images
+# with four bytes per pixel.
+PIL_RGB = 4
+MASK_TEMPORARIES = {"flexible": 22, None: 4}
+
+# The layered engine labels pixels with per-layer temporaries (colour
+# targets being the costliest), keeps every layer's distance field at
+# once, and places dots a band of the label map at a time
+LAYERED_TEMPORARIES = 27    # per pixel and layer
+BAND_BYTES = 22             # per pixel of a band
+
+_TILE = 64
+
+
+def load_model(path):
+    with open(path) as f:
+        return dict(DEFAULT_MODEL, **json.load(f))
+
+
+def _edge_windows(mask, cap):
+    # Pixels of the padded windows distance_field transforms around edges
+    h, w = mask.shape
+    pad = int(math.ceil(cap))
+    tile = max(_TILE, pad)
+
+    rows = np.arange(0, h, tile)
+    cols = np.arange(0, w, tile)
+    counts = np.add.reduceat(np.add.reduceat(mask, rows, axis=0, dtype=np.int64), cols, axis=1)
+    sizes = np.outer(np.diff(rows, append=h), np.diff(cols, append=w))
+    mixed = ((counts > 0) & (counts < sizes)).sum()
+
+    # Tiles next to an edge are transformed too
+    return int(mixed * 3 * (tile + 2 * pad) ** 2)
+
+
+def _layer_stats(width, height, occupancy, radius, density, **_):
+    # Stand-ins for a layer known only by its occupancy: one compact blob
+    area = occupancy * width * height
+    perimeter = 2 * math.sqrt(math.pi * area)
+    pad = math.ceil(_dist_cap(radius))
+    tile = max(_TILE, pad)
+
+    cells = math.ceil(height / density) * math.ceil(width / density)
+    occupied = min(cells, occupancy * cells + perimeter / density)
+    dots = 0.9 * occupied
+
+    return {
+        "cells": cells,
+        "occupied": occupied,
+        "dots": dots,
+        "dot_area": dots * math.pi * (1.2 * radius) ** 2,
+        "edge_windows": 3 * perimeter / tile * (tile + 2 * pad) ** 2,
+    }
+
+
+# --------------------------------------------------
+# Estimation
+# --------------------------------------------------
+def estimate(width, height, layers, scale=3, resample="lanczos", mode=None, model=None):
+    """
+    Predict the runtime and memory of each stage of a render, by the
+    two-colour modes' engine or, for mode "layered", the layered engine.
+
+    `layers` holds one dot dict per layer, each with an `occupancy` entry
+    (the fraction of pixels in the layer's colour block). Entries from
+    `layer_stats` may be merged in to replace the occupancy-based guesses
+    with measurements. Returns the stages as (name, seconds, live bytes)
+    tuples, the total seconds and the peak bytes.
+    """
+    model = model or DEFAULT_MODEL
+    px = width * height
+    canvas_px = px * scale * scale
+    n = len(layers)
+
+    stats = [dict(_layer_stats(width, height, **layer), **layer) for layer in layers]
+
+    inputs = PIL_RGB * px + 3 * px
+    masks = n * px
+    field = 4 * px
+    canvas = PIL_RGB * canvas_px
+
+    if resample == "lanczos":
+        downsample_bytes = PIL_RGB * (width * height * scale + px)
+    else:
+        downsample_bytes = PIL_RGB * px
+
+    temporaries = MASK_TEMPORARIES.get(mode, MASK_TEMPORARIES[None])
+
+    def place_seconds(s):
+        return model["cell"] * s["cells"] + model["dot"] * s["occupied"]
+
+    placing = 0
+
+    if mode == "layered":
+        masks = px
+        field = 4 * px * n
+        temporaries = LAYERED_TEMPORARIES * n
+
+        def place_seconds(s):
+            return model["labelled"] * s["occupancy"] * px
+
+        placing = BAND_BYTES * min(LABEL_BAND_PIXELS, px) + DOT_DTYPE.itemsize * sum(s["dots"] for s in stats)
+
+    stages = [
+        ("load", 0.0, inputs),
+        ("masks", model["mask"] * px * n, inputs + masks + temporaries * px),
+        ("canvas", model["canvas"] * canvas_px, inputs + masks + canvas),
+        (
+            "distance",
+            sum(model["dist_scan"] * px + model["edt"] * s["edge_windows"] for s in stats),
+            inputs + masks + canvas + field,
+        ),
+        (
+            "dots",
+            sum(
+                place_seconds(s)
+                + model["draw"] * s["dots"]
+                + model["fill"] * s["dot_area"] * scale * scale
+                for s in stats
+            ),
+            inputs + masks + canvas + field + placing,
+        ),
+        ("downsample", model[resample] * canvas_px, inputs + masks + canvas + downsample_bytes),
+        ("save", model["encode"] * px, inputs + masks + PIL_RGB * px + 3 * px),
+    ]
+
+    return {
+        "stages": stages,
+        "seconds": sum(s[1] for s in stages),
+        "peak_memory": max(s[2] for s in stages),
+    }
+
+
+def layer_stats(img, mode, **options):
+    """
+    Measure the inputs of `estimate` from an image: one dot dict per layer
+    with its occupancy, edge extent and predicted dots merged in.
+    """
+    arr = np.array(img)
+    h, w, _ = arr.shape
+
+    layers = []
+    for mask, _, dots in mode_layers(arr, mode, **options):
+        cap = _dist_cap(dots["radius"])
+        prediction = predict_layer(mask, **dots)
+
+        layers.append(dict(
+            dots,
+            occupancy=float(mask.mean()),
+            cells=math.ceil(h / dots["density"]) * math.ceil(w / dots["density"]),
+            occupied=prediction["cells"],
+            dots=prediction["dots"],
+            dot_area=prediction["coverage"] * float(mask.sum()),
+            edge_windows=_edge_windows(mask, cap),
+        ))
+
+    return layers
+
+
+def recommend(width, height, layers, scale=3, resample="lanczos", mode=None, model=None, memory_budget=None, time_budget=None):
+    """
+    Estimate a render and, if it would exceed `memory_budget` (bytes) or
+    `time_budget` (seconds), suggest the largest scale and cheapest filter
+    that fit. Returns (estimate, advice), advice being a list of strings.
+    """
+    def fits(result):
+        return (
+            (memory_budget is None or result["peak_memory"] <= memory_budget)
+            and (time_budget is None or result["seconds"] <= time_budget)
+        )
+
+    result = estimate(width, height, layers, scale, resample, mode, model)
+    if fits(result):
+        return result, []
+
+    for filt in dict.fromkeys((resample, "box")):
+        for s in range(scale, 0, -1):
+            if (s, filt) == (scale, resample):
+                continue
+            if fits(estimate(width, height, layers, s, filt, mode, model)):
+                return result, [f"Use scale={s} with resample=\"{filt}\" to fit the budget"]
+
+    # Even the cheapest render does not fit: work on parts of the image
+    single = estimate(width, height, layers, 1, "box", mode, model)
+    memory_tiles = time_tiles = 1
+    if memory_budget is not None:
+        memory_tiles = math.ceil(single["peak_memory"] / memory_budget)
+    if time_budget is not None:
+        time_tiles = math.ceil(single["seconds"] / time_budget)
+
+    # Tiles only save time when they are rendered side by side
+    where = " rendered in parallel (e.g. by queue workers)" if time_tiles > memory_tiles else ""
+    return result, [
+        "No scale fits the budget for the whole image",
+        f"Split the input into about {max(memory_tiles, time_tiles, 2)} tiles{where}, or stream its dots with iter_dots(order=\"tile\")",
+    ]
+
+
+# --------------------------------------------------
+# Calibration
+# --------------------------------------------------
+def _timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(size=600):
+    """Measure the cost model on this machine, using a synthetic red-blue stimulus."""
+    h = w = size
+    yy, xx = np.mgrid[:h, :w]
+    rr = np.hypot(yy - h / 2, xx - w / 2)
+
+    arr = np.zeros((h, w, 3), dtype=np.uint8)
+    arr[rr < size * 0.2] = (255, 0, 0)
+    arr[(rr > size * 0.3) & (rr < size * 0.45)] = (0, 0, 255)
+
+    dots = dict(radius=1.8, density=8, jitter=0.5, ratio=0.5, shape="circle")
+    options = dict(red_dots=dots, blue_dots=dots)
+    model = {}
+
+    model["mask"] = _timed(lambda: mode_layers(arr, "red-blue", **options)) / (2 * h * w)
+    layer_list = mode_layers(arr, "red-blue", **options)
+    mask = layer_list[0][0]
+    cap = _dist_cap(dots["radius"])
+
+    empty = np.zeros((h, w), dtype=bool)
+    model["dist_scan"] = _timed(lambda: distance_field(empty, cap)) / (h * w)
+    edge_time = _timed(lambda: distance_field(mask, cap)) - model["dist_scan"] * h * w
+    model["edt"] = max(edge_time, 0.0) / _edge_windows(mask, cap)
+
+    dist = distance_field(mask, cap)
+    cells = math.ceil(h / dots["density"]) * math.ceil(w / dots["density"])
+
+    def place(m):
+        rng = CounterRNG(0)
+        return list(_place_dots(m, dist, dots["radius"], dots["density"], dots["jitter"], dots["ratio"], h, w, rng))
+
+    model["cell"] = _timed(lambda: place(empty)) / cells
+    placed = place(mask)
+    occupied = int(np.add.reduceat(np.add.reduceat(mask, np.arange(0, h, dots["density"]), axis=0), np.arange(0, w, dots["density"]), axis=1).astype(bool).sum())
+    model["dot"] = max(_timed(lambda: place(mask)) - model["cell"] * cells, 0.0) / occupied
+
+    label = mask.astype(np.uint8)
+    model["labelled"] = _timed(lambda: _place_labelled(label, [dist], [dots], CounterRNG(0))) / int(mask.sum())
+
+    # Drawing: fit a per-dot and a per-pixel cost from two scales
+    dot_list = [d for d in placed if d is not None]
+    area = sum(math.pi * r * r for _, _, r, _ in dot_list)
+
+    def draw(scale):
+        canvas = Image.new("RGB", (w * scale, h * scale))
+        target = ImageDraw.Draw(canvas)
+        for x, y, r, _ in dot_list:
+            x, y, r = x * scale, y * scale, r * scale
+            target.ellipse((x - r, y - r, x + r, y + r), fill=(255, 0, 0))
+
+    t1, t4 = _timed(lambda: draw(1)), _timed(lambda: draw(4))
+    model["fill"] = max(t4 - t1, 0.0) / (15 * area)
+    model["draw"] = max(t1 - model["fill"] * area, 0.0) / len(dot_list)
+
+    scale = 3
+    canvas_px = h * w * scale * scale
+    model["canvas"] = _timed(lambda: Image.new("RGB", (w * scale, h * scale))) / canvas_px
+
+    canvas = Image.new("RGB", (w * scale, h * scale))
+    _render_dots(ImageDraw.Draw(canvas), mask, (255, 0, 0), scale=scale, h=h, w=w, progress=None, total_work=None, rng=CounterRNG(0), **dots)
+    model["lanczos"] = _timed(lambda: _downsample(canvas, scale, "lanczos")) / canvas_px
+    model["box"] = _timed(lambda: _downsample(canvas, scale, "box")) / canvas_px
+
+    out = _downsample(canvas, scale, "lanczos")
+    model["encode"] = _timed(lambda: out.save(BytesIO(), "PNG")) / (h * w)
+
+    return model
@@ -0,0 +1,684 @@
+import importlib
+import itertools
+import math
+import secrets
+
+from PIL import Image
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+
+# --------------------------------------------------
+# Placed dot record
+# --------------------------------------------------
+# Coordinates and radii are in input-image pixels. `layer` is the index of
+# the dot layer in drawing (z) order, so consumers can composite batches
+# exactly as the renderer does.
+DOT_DTYPE = np.dtype([
+    ("x", np.float32),
+    ("y", np.float32),
+    ("r", np.float32),
+    ("layer", np.uint8),
+    ("small", np.bool_),
+    ("square", np.bool_),
+    ("colour", np.uint8, (3,)),
+])
+
+# Step, in pixels, of quantised (uint8) distance fields
+DIST_QUANTUM = 1 / 16
+
+# Pixels per band of the label map placed at once by the layered engine
+LABEL_BAND_PIXELS = 2**20
+
+MODES = {
+    "red-blue": "red_blue",
+    "red-green": "red_green",
+    "red-grey": "red_grey",
+    "flexible": "flexible",
+    "layered": "layered",
+}
+
+
+def mode_module(mode):
+    """Return the module implementing a mode, e.g. red_blue for "red-blue"."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    return importlib.import_module(f".{MODES[mode]}", __package__)
+
+
+# --------------------------------------------------
+# Colour rules
+# --------------------------------------------------
+# The fixed colour rules of the two-colour modes, also usable by name in
+# "layered", and the colours their dots are drawn in
+def _channels(arr):
+    # Widened, so sums and differences cannot wrap around
+    rgb = np.asarray(arr)[:, :, :3].astype(np.int16)
+    return rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
+
+
+def _red_rule(arr):
+    r, g, b = _channels(arr)
+    return (r > 150) & (r > g + 40) & (r > b + 40)
+
+
+def _green_rule(arr):
+    r, g, b = _channels(arr)
+    return (g > 100) & (g > r + 40) & (g > b + 40)
+
+
+def _blue_rule(arr):
+    r, g, b = _channels(arr)
+    return (b > 150) & (b > r + 40) & (b > g + 40)
+
+
+def _grey_rule(arr):
+    r, g, b = _channels(arr)
+    return (np.abs(r - g) < 5) & (np.abs(r - b) < 5) & (r > 50) & (r < 150)
+
+
+RULES = {
+    "red": _red_rule,
+    "blue": _blue_rule,
+    "green": _green_rule,
+    "grey": _grey_rule,
+}
+
+RULE_COLOURS = {
+    "red": (255, 0, 0),
+    "blue": (0, 0, 255),
+    "green": (0, 200, 0),
+    "grey": (96, 96, 96),
+}
+
+
+def mode_layers(arr, mode, **options):
+    """Return the (mask, colour, dots) layers of a mode, in drawing order."""
+    return mode_module(mode).layers(arr, **options)
+
+
+def stimulus_layers(img, mode, **options):
+    """
+    Return the (mask, colour, dots) layers of a mode for a PIL image or a
+    VectorImage, in drawing order.
+    """
+    from .vector import VectorImage
+
+    if isinstance(img, VectorImage):
+        return img.layers(mode, **options)
+
+    return mode_layers(np.asarray(img), mode, **options)
+
+
+# --------------------------------------------------
+# Counter-based randomness
+# --------------------------------------------------
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+# Uniforms drawn per cell: pixel pick, x and y jitter, small/large, size
+STREAMS = 5
+
+
+def _mix64(x):
+    # SplitMix64 finaliser, applied elementwise
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * _MIX1
+        x = (x ^ (x >> np.uint64(27))) * _MIX2
+    return x ^ (x >> np.uint64(31))
+
+
+class CounterRNG:
+    """
+    Random source keyed by (seed, variant, layer, cell, stream).
+
+    Every uniform is a hash of its key rather than the next value of a
+    sequence, so any variant of a stimulus, or any cell of it, can be
+    reproduced on its own, in any order and in parallel. Without a seed, a
+    random one is drawn and kept in `seed`.
+    """
+
+    def __init__(self, seed=None, variant=0):
+        if seed is None:
+            seed = secrets.randbits(64)
+        self.seed = seed
+        self.variant = variant
+
+        with np.errstate(over="ignore"):
+            key = _mix64(np.uint64(seed % 2**64) + _GOLDEN)
+            self._key = _mix64(key ^ _mix64(np.uint64(variant % 2**64) + _GOLDEN * np.uint64(2)))
+
+    def uniforms(self, layer, cell, stream):
+        """Uniforms in [0, 1) for broadcastable arrays of layers, cells and streams."""
+        with np.errstate(over="ignore"):
+            key = _mix64(self._key ^ _mix64(np.asarray(layer, dtype=np.uint64) * _GOLDEN + np.uint64(1)))
+            counter = np.asarray(cell, dtype=np.uint64) * np.uint64(STREAMS) + np.asarray(stream, dtype=np.uint64)
+            x = _mix64(key ^ _mix64(counter))
+        return (x >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+    def cell_uniforms(self, layer, cells):
+        """All STREAMS uniforms of the given cells of one layer, as a (STREAMS, n) array."""
+        return self.uniforms(layer, cells, np.arange(STREAMS)[:, None])
+
+
+# --------------------------------------------------
+# Bounded distance field
+# --------------------------------------------------
+def _dist_cap(radius):
+    # Placement only distinguishes distances up to the edge falloff (5 px)
+    # and the largest radius it can clip, so anything beyond is equivalent.
+    return max(5.0, 1.6 * radius + 0.6)
+
+
+def distance_field(mask, cap=5.0, tile=64, quantise=False, out=None):
+    """
+    Euclidean distance to the nearest False pixel, truncated at `cap`.
+
+    Only tiles within `cap` of an edge are transformed, each on a window
+    padded by `cap`, so the cost follows the edge length rather than the
+    image area. Values are exact up to `cap`. The field is float32, or
+    uint8 in steps of DIST_QUANTUM when `quantise` is set. A preallocated
+    array of the right shape and dtype may be passed as `out`.
+    """
+    if quantise and cap > 255 * DIST_QUANTUM:
+        raise ValueError(f"cap must be at most {255 * DIST_QUANTUM} when quantised")
+
+    h, w = mask.shape
+    pad = int(np.ceil(cap))
+    tile = max(tile, pad)
+
+    dtype = np.uint8 if quantise else np.float32
+    fill = round(cap / DIST_QUANTUM) if quantise else cap
+
+    if out is None:
+        out = np.empty((h, w), dtype=dtype)
+    elif out.shape != (h, w) or out.dtype != dtype:
+        raise ValueError(f"out must be a {dtype.__name__} array of shape {(h, w)}")
+
+    # -------------------------
+    # Classify tiles
+    # -------------------------
+    rows = np.arange(0, h, tile)
+    cols = np.arange(0, w, tile)
+    counts = np.add.reduceat(np.add.reduceat(mask, rows, axis=0, dtype=np.int64), cols, axis=1)
+    sizes = np.outer(np.diff(rows, append=h), np.diff(cols, append=w))
+
+    ty, tx = counts.shape
+
+    # Outside the image counts as full: it is not background to the EDT
+    full = np.ones((ty + 2, tx + 2), dtype=bool)
+    full[1:-1, 1:-1] = counts == sizes
+    interior = np.ones((ty, tx), dtype=bool)
+    for dy in range(3):
+        for dx in range(3):
+            interior &= full[dy:dy + ty, dx:dx + tx]
+
+    # -------------------------
+    # Fill tiles
+    # -------------------------
+    for j in range(ty):
+        for i in range(tx):
+            y0, x0 = j * tile, i * tile
+            y1, x1 = min(y0 + tile, h), min(x0 + tile, w)
+
+            if counts[j, i] == 0:
+                out[y0:y1, x0:x1] = 0
+                continue
+
+            if interior[j, i]:
+                out[y0:y1, x0:x1] = fill
+                continue
+
+            ya, xa = max(y0 - pad, 0), max(x0 - pad, 0)
+            yb, xb = min(y1 + pad, h), min(x1 + pad, w)
+
+            window = mask[ya:yb, xa:xb]
+            if window.all():
+                out[y0:y1, x0:x1] = fill
+                continue
+
+            d = distance_transform_edt(window)[y0 - ya:y1 - ya, x0 - xa:x1 - xa]
+            d = np.minimum(d, cap)
+            if quantise:
+                d = np.round(d / DIST_QUANTUM)
+            out[y0:y1, x0:x1] = d
+
+    return out
+
+
+# --------------------------------------------------
+# Supersampling
+# --------------------------------------------------
+RESAMPLE_FILTERS = ("lanczos", "box")
+
+
+def _box_reduce(arr, factor):
+    # Exact area average over factor x factor blocks
+    h, w = arr.shape[0] // factor, arr.shape[1] // factor
+    blocks = arr.reshape(h, factor, w, factor, *arr.shape[2:])
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def _downsample(canvas, scale, resample="lanczos"):
+    size = (canvas.width // scale, canvas.height // scale)
+
+    if resample == "lanczos":
+        return canvas.resize(size, Image.LANCZOS)
+    if resample == "box":
+        # Same block average as _box_reduce, without copying the canvas out of PIL
+        return canvas.reduce(scale)
+
+    raise ValueError(f"Unknown resample filter: {resample}")
+
+
+# --------------------------------------------------
+# Cell traversal
+# --------------------------------------------------
+def _cell_range(h, w, density, region=None):
+    # Rows cy0:cy1 and columns cx0:cx1 of the cells whose origin lies in
+    # `region` (x0, y0, x1, y1), or of every cell
+    rows = -(-h // density)
+    cols = -(-w // density)
+    if region is None:
+        return 0, rows, 0, cols
+
+    rx0, ry0, rx1, ry1 = region
+
+    def first(v, n):
+        return min(max(math.ceil(v / density), 0), n)
+
+    cy0, cx0 = first(ry0, rows), first(rx0, cols)
+    return cy0, max(first(ry1, rows), cy0), cx0, max(first(rx1, cols), cx0)
+
+
+def _cell_blocks(h, w, density, order="scan", tile=16, region=None):
+    # Blocks of cells in visiting order, as (rows, columns) ranges of the
+    # cell grid: one row per block for "scan", one tile for "tile"
+    cy0, cy1, cx0, cx1 = _cell_range(h, w, density, region)
+
+    if order == "scan":
+        for cy in range(cy0, cy1):
+            yield range(cy, cy + 1), range(cx0, cx1)
+
+    elif order == "tile":
+        # Tiles stay aligned to the full grid, so `region` keeps their order
+        for ty in range(cy0 - cy0 % tile, cy1, tile):
+            for tx in range(cx0 - cx0 % tile, cx1, tile):
+                yield (
+                    range(max(ty, cy0), min(ty + tile, cy1)),
+                    range(max(tx, cx0), min(tx + tile, cx1)),
+                )
+
+    else:
+        raise ValueError(f"Unknown order: {order}")
+
+
+def _region_window(h, w, dots, region):
+    # Pixels (y0, y1, x0, x1) that placing the cells in `region` reads: the
+    # cells, widened by the jitter, and by the reach of their distance field
+    density = dots["density"]
+    cy0, cy1, cx0, cx1 = _cell_range(h, w, density, region)
+    margin = math.ceil(dots["jitter"]) + 1 + math.ceil(_dist_cap(dots["radius"]))
+
+    return (
+        max(cy0 * density - margin, 0),
+        min(cy1 * density + margin, h),
+        max(cx0 * density - margin, 0),
+        min(cx1 * density + margin, w),
+    )
+
+
+# --------------------------------------------------
+# Dot placement
+# --------------------------------------------------
+def _place_dots(
+    mask,
+    dist,
+    radius,
+    density,
+    jitter,
+    ratio,
+    h,
+    w,
+    rng,
+    layer=0,
+    order="scan",
+    tile=16,
+    region=None,
+    offset=(0, 0),
+):
+    """
+    Yield one entry per cell: None if no dot is placed, else (x, y, r, is_small).
+    With `region` (x0, y0, x1, y1), only cells whose origin lies inside it
+    are visited. `mask` and `dist` may then cover just the window of the
+    h x w image returned by `_region_window`, whose top-left pixel is
+    `offset` (y, x).
+    """
+    top, left = offset
+
+    cols = -(-w // density)
+
+    # Uniforms are drawn one block of cells at a time, keyed by full-grid
+    # cell ids, so memory does not grow with the image
+    for block_rows, block_cols in _cell_blocks(h, w, density, order, tile, region):
+        ids = np.arange(block_rows.start, block_rows.stop)[:, None] * cols + np.arange(block_cols.start, block_cols.stop)
+        u = rng.cell_uniforms(layer, ids.ravel())
+
+        for k, (cy, cx) in enumerate(itertools.product(block_rows, block_cols)):
+            y0, x0 = cy * density, cx * density
+            y1 = min(y0 + density, h)
+            x1 = min(x0 + density, w)
+
+            cell = mask[y0 - top:y1 - top, x0 - left:x1 - left]
+            if not cell.any():
+                yield None
+                continue
+
+            u_pick, u_x, u_y, u_small, u_size = u[:, k]
+
+            ys, xs = np.where(cell)
+            i = int(u_pick * len(xs))
+
+            x = x0 + xs[i] + (2 * u_x - 1) * jitter
+            y = y0 + ys[i] + (2 * u_y - 1) * jitter
+
+            xi = int(round(x))
+            yi = int(round(y))
+
+            if xi < 0 or xi >= w or yi < 0 or yi >= h:
+                yield None
+                continue
+
+            d = float(dist[yi - top, xi - left])
+            if dist.dtype == np.uint8:
+                d *= DIST_QUANTUM
+
+            if d <= 0.6:
+                yield None
+                continue
+
+            edge_norm = min(1.0, d / 5.0)
+            is_small = u_small < ratio
+
+            if is_small:
+                r = radius * (0.5 + 0.3 * u_size)
+            else:
+                r = radius * (1.1 + 0.5 * u_size)
+
+            r *= (0.6 + 0.4 * edge_norm)
+            r = min(r, d - 0.6)
+
+            if r <= 0.6:
+                yield None
+                continue
+
+            yield x, y, r, bool(is_small)
+
+
+def _restore_cached(cache, img, mode, output_path, seed, variant, show, return_index, render_options, **options):
+    """
+    Serve a generate() request from `cache` if it holds it.
+
+    `options` are the mode's own keyword arguments and `render_options`
+    those that only affect drawing (e.g. scale and resample); both identify
+    the request. Returns (key, hit, index): the key to store the render
+    under (None when it cannot be cached), whether the cached output was
+    restored to `output_path`, and on a hit with `return_index`, a DotIndex
+    over its dots.
+    """
+    from .cache import request_key
+    from .spatial import index_dots
+
+    key = request_key(cache, img, mode, seed, output_path, variant=variant, **render_options, **options)
+    if key is None or not cache.restore(key, output_path):
+        return key, False, None
+
+    print(f"Saved cached image to: {output_path}")
+    if show:
+        Image.open(output_path).show()
+
+    index = index_dots(img, mode, seed=seed, variant=variant, **options) if return_index else None
+    return key, True, index
+
+
+def _render_dots(
+    draw,
+    mask,
+    colour,
+    radius,
+    density,
+    jitter,
+    ratio,
+    shape,
+    scale,
+    h,
+    w,
+    progress,
+    total_work,
+    rng,
+    layer=0,
+    dist=None,
+    record=None,
+):
+
+    if dist is None:
+        dist = distance_field(mask, cap=_dist_cap(radius))
+
+    placed = _place_dots(mask, dist, radius, density, jitter, ratio, h, w, rng, layer)
+
+    for dot in placed:
+        if progress is not None:
+            progress["done"] += 1
+            percent = int((progress["done"] / total_work) * 100)
+
+            if percent % 5 == 0 and percent != progress["last_print"]:
+                print(f"Rendering: {percent}%")
+                progress["last_print"] = percent
+
+        if dot is None:
+            continue
+
+        if record is not None:
+            record.append(dot[:3] + (layer, dot[3], shape == "square", colour))
+
+        x, y, r, _ = dot
+        x, y, r = x * scale, y * scale, r * scale
+
+        if shape == "square":
+            draw.rounded_rectangle(
+                (x - r, y - r, x + r, y + r),
+                radius=0.25 * r,
+                fill=colour
+            )
+        else:
+            draw.ellipse(
+                (x - r, y - r, x + r, y + r),
+                fill=colour
+            )
+
+
+def _place_labelled(label, fields, dots_list, rng, band_pixels=LABEL_BAND_PIXELS):
+    """
+    Place the dots of every layer of a label map (0 for background, i + 1
+    for layer i), vectorised over the labelled pixels of one band of whole
+    cell rows at a time, drawing the same counter-based uniforms as
+    _place_dots. Bands span about `band_pixels` pixels, bounding the
+    working memory. Returns the placed dots as a DOT_DTYPE array ordered by
+    layer; `colour` is left for the caller to fill in.
+    """
+    h, w = label.shape
+    batches = []
+
+    for i, dots in enumerate(dots_list):
+        density = dots["density"]
+        cols = -(-w // density)
+        field = fields[i]
+        step = density * max(1, band_pixels // (density * w))
+
+        for top in range(0, h, step):
+            ys, xs = np.nonzero(label[top:top + step] == i + 1)
+            if not ys.size:
+                continue
+
+            ys = ys.astype(np.int32) + np.int32(top)
+            xs = xs.astype(np.int32)
+
+            # -------------------------
+            # Cell ids; pixels keep their row-major order within each cell
+            # -------------------------
+            cell = (ys // density).astype(np.int64) * cols + xs // density
+            order = np.argsort(cell, kind="stable").astype(np.int32)
+            sorted_cells = cell[order]
+            del cell
+
+            start = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+            count = np.diff(np.r_[start, sorted_cells.size])
+
+            # -------------------------
+            # Pick, jitter and size one dot per non-empty cell
+            # -------------------------
+            u = rng.cell_uniforms(i, sorted_cells[start])
+            pick = order[start + (u[0] * count).astype(np.int64)]
+
+            x = xs[pick] + (2 * u[1] - 1) * dots["jitter"]
+            y = ys[pick] + (2 * u[2] - 1) * dots["jitter"]
+
+            xi = np.round(x).astype(np.int64)
+            yi = np.round(y).astype(np.int64)
+            inside = (xi >= 0) & (xi < w) & (yi >= 0) & (yi < h)
+
+            dist = np.zeros(start.size, dtype=np.float64)
+            dist[inside] = field[yi[inside], xi[inside]]
+            if field.dtype == np.uint8:
+                dist *= DIST_QUANTUM
+
+            edge_norm = np.minimum(1.0, dist / 5.0)
+            is_small = u[3] < dots["ratio"]
+
+            r = dots["radius"] * np.where(is_small, 0.5 + 0.3 * u[4], 1.1 + 0.5 * u[4])
+            r *= (0.6 + 0.4 * edge_norm)
+            r = np.minimum(r, dist - 0.6)
+
+            keep = inside & (dist > 0.6) & (r > 0.6)
+
+            batch = np.zeros(int(keep.sum()), dtype=DOT_DTYPE)
+            batch["x"] = x[keep]
+            batch["y"] = y[keep]
+            batch["r"] = r[keep]
+            batch["layer"] = i
+            batch["small"] = is_small[keep]
+            batch["square"] = dots["shape"] == "square"
+            batches.append(batch)
+
+    return np.concatenate(batches) if batches else np.empty(0, dtype=DOT_DTYPE)
+
+
+# --------------------------------------------------
+# Streaming API
+# --------------------------------------------------
+def _region_layers(img, mode, region, **options):
+    # Layers cropped to the window that placing `region` reads, with the
+    # window's top-left pixel. Masks are per pixel, so raster images are
+    # cropped before classifying; an empty crop yields just the dot options.
+    from .vector import VectorImage
+
+    w, h = img.size
+    vector = isinstance(img, VectorImage)
+
+    if vector:
+        layer_list = stimulus_layers(img, mode, **options)
+    else:
+        arr = np.asarray(img)
+        layer_list = mode_layers(arr[:0, :0], mode, **options)
+
+    windows = [_region_window(h, w, dots, region) for _, _, dots in layer_list]
+    y0 = min((win[0] for win in windows), default=0)
+    y1 = max((win[1] for win in windows), default=0)
+    x0 = min((win[2] for win in windows), default=0)
+    x1 = max((win[3] for win in windows), default=0)
+
+    if vector:
+        layer_list = [(mask[y0:y1, x0:x1], colour, dots) for mask, colour, dots in layer_list]
+    else:
+        layer_list = mode_layers(arr[y0:y1, x0:x1], mode, **options)
+
+    return layer_list, y0, x0
+
+
+def iter_dots(
+    img,
+    mode,
+    batch_size=4096,
+    order="scan",
+    tile=16,
+    seed=None,
+    variant=0,
+    region=None,
+    **options,
+):
+    """
+    Lazily yield the dots of a stimulus as DOT_DTYPE structured arrays.
+
+    Layers are produced in drawing order; within a layer, cells are visited
+    row by row ("scan") or in square blocks of `tile` x `tile` cells
+    ("tile"). Each batch holds at most `batch_size` dots, so memory stays
+    bounded regardless of the image size. `options` are the mode's own
+    keyword arguments, e.g. `red_dots`/`blue_dots` for "red-blue".
+
+    The same `seed` and `variant` always give the same dots as rendering,
+    whatever the order. With `region` (x0, y0, x1, y1), only the dots of
+    cells starting inside it are produced, and only a window around it is
+    classified and transformed, so the cost follows the region's size.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    rng = CounterRNG(seed, variant)
+
+    w, h = img.size
+
+    batch = np.empty(batch_size, dtype=DOT_DTYPE)
+    n = 0
+
+    if region is None:
+        layer_list, top, left = stimulus_layers(img, mode, **options), 0, 0
+    else:
+        layer_list, top, left = _region_layers(img, mode, region, **options)
+
+    for layer, (mask, colour, dots) in enumerate(layer_list):
+        dist = distance_field(mask, cap=_dist_cap(dots["radius"]))
+        square = dots["shape"] == "square"
+
+        placed = _place_dots(
+            mask,
+            dist,
+            dots["radius"],
+            dots["density"],
+            dots["jitter"],
+            dots["ratio"],
+            h,
+            w,
+            rng,
+            layer=layer,
+            order=order,
+            tile=tile,
+            region=region,
+            offset=(top, left),
+        )
+
+        for dot in placed:
+            if dot is None:
+                continue
+
+            x, y, r, is_small = dot
+            batch[n] = (x, y, r, layer, is_small, square, colour)
+            n += 1
+
+            if n == batch_size:
+                yield batch.copy()
+                n = 0
+
+    if n:
+        yield batch[:n].copy()
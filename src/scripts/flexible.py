@@ -1,9 +1,10 @@
 from PIL import Image, ImageDraw
 import numpy as np
-import random
-from scipy.ndimage import distance_transform_edt
 import re
 
+from .dots import DOT_DTYPE, CounterRNG, _downsample, _render_dots, _restore_cached, stimulus_layers
+from .spatial import DotIndex
+
 
 # --------------------------------------------------
 # HEX -> RGB
@@ -21,6 +22,22 @@ def colour_mask(arr, target_rgb, tolerance):
     return dist <= tolerance
 
 
+def layers(arr, colour1, colour2, dots1, dots2, tolerance=40):
+    colour1_rgb = hex_to_rgb(colour1)
+    colour2_rgb = hex_to_rgb(colour2)
+
+    # -------------------------
+    # Colour masks
+    # -------------------------
+    mask1 = colour_mask(arr, colour1_rgb, tolerance)
+    mask2 = colour_mask(arr, colour2_rgb, tolerance)
+
+    return [
+        (mask1, colour1_rgb, dots1),
+        (mask2, colour2_rgb, dots2),
+    ]
+
+
 # --------------------------------------------------
 # Main generator
 # --------------------------------------------------
@@ -33,35 +50,55 @@ def generate(
     dots2,
     tolerance=40,
     scale=3,
+    resample="lanczos",
+    show=True,
+    seed=None,
+    variant=0,
+    cache=None,
+    return_index=False,
 ):
 
-    random.seed()
-
-
     # -------------------------
-    # Load image
+    # Cached result
     # -------------------------
-    arr = np.array(img)
-    h, w, _ = arr.shape
+    key, hit, index = _restore_cached(
+        cache,
+        img,
+        "flexible",
+        output_path,
+        seed,
+        variant,
+        show,
+        return_index,
+        dict(scale=scale, resample=resample),
+        colour1=colour1,
+        colour2=colour2,
+        dots1=dots1,
+        dots2=dots2,
+        tolerance=tolerance,
+    )
+    if hit:
+        return index
 
-    colour1_rgb = hex_to_rgb(colour1)
-    colour2_rgb = hex_to_rgb(colour2)
+    rng = CounterRNG(seed, variant)
+    record = [] if return_index else None
 
 
     # -------------------------
-    # Colour masks
+    # Load image
     # -------------------------
-    mask1 = colour_mask(arr, colour1_rgb, tolerance)
-    mask2 = colour_mask(arr, colour2_rgb, tolerance)
+    w, h = img.size
+
+    layer_list = stimulus_layers(img, "flexible", colour1=colour1, colour2=colour2, dots1=dots1, dots2=dots2, tolerance=tolerance)
 
 
     # -------------------------
     # High-resolution canvas
     # -------------------------
     out_hi = Image.new(
-        "RGBA",
+        "RGB",
         (w * scale, h * scale),
-        (0, 0, 0, 255)
+        (0, 0, 0)
     )
     draw = ImageDraw.Draw(out_hi)
 
@@ -72,10 +109,7 @@ def generate(
     def cells(density):
         return ((h + density - 1) // density) * ((w + density - 1) // density)
 
-    total_work = (
-        cells(dots1["density"]) +
-        cells(dots2["density"])
-    )
+    total_work = sum(cells(dots["density"]) for _, _, dots in layer_list)
 
     progress = {"done": 0, "last_print": -1}
 
@@ -83,29 +117,21 @@ def generate(
     # -------------------------
     # Render dot layers
     # -------------------------
-    _render_dots(
-        draw=draw,
-        mask=mask1,
-        colour=colour1_rgb,
-        scale=scale,
-        h=h,
-        w=w,
-        progress=progress,
-        total_work=total_work,
-        **dots1,
-    )
-
-    _render_dots(
-        draw=draw,
-        mask=mask2,
-        colour=colour2_rgb,
-        scale=scale,
-        h=h,
-        w=w,
-        progress=progress,
-        total_work=total_work,
-        **dots2,
-    )
+    for layer, (mask, colour, dots) in enumerate(layer_list):
+        _render_dots(
+            draw=draw,
+            mask=mask,
+            colour=colour,
+            scale=scale,
+            h=h,
+            w=w,
+            progress=progress,
+            total_work=total_work,
+            rng=rng,
+            layer=layer,
+            record=record,
+            **dots,
+        )
 
     if progress["last_print"] != 100:
         print("Rendering: 100%")
@@ -114,84 +140,16 @@ def generate(
     # -------------------------
     # Downsample & save
     # -------------------------
-    out = out_hi.resize((w, h), Image.LANCZOS).convert("RGB")
+    out = _downsample(out_hi, scale, resample)
     out.save(output_path)
-    print(f"Saved image to: {output_path}")
-    out.show()
-
-
-# --------------------------------------------------
-# Dot renderer
-# --------------------------------------------------
-def _render_dots(
-    draw,
-    mask,
-    colour,
-    radius,
-    density,
-    jitter,
-    ratio,
-    shape,
-    scale,
-    h,
-    w,
-    progress,
-    total_work,
-):
 
-    dist = distance_transform_edt(mask)
+    if key is not None:
+        cache.store(key, output_path)
 
-    for y0 in range(0, h, density):
-        for x0 in range(0, w, density):
-            progress["done"] += 1
-            percent = int((progress["done"] / total_work) * 100)
-
-            if percent % 5 == 0 and percent != progress["last_print"]:
-                print(f"Rendering: {percent}%")
-                progress["last_print"] = percent
-
-            y1 = min(y0 + density, h)
-            x1 = min(x0 + density, w)
-
-            cell = mask[y0:y1, x0:x1]
-            if not cell.any():
-                continue
-
-            ys, xs = np.where(cell)
-            i = random.randrange(len(xs))
-
-            x = (x0 + xs[i] + random.uniform(-jitter, jitter)) * scale
-            y = (y0 + ys[i] + random.uniform(-jitter, jitter)) * scale
-
-            xi = int(round(x / scale))
-            yi = int(round(y / scale))
-
-            if xi < 0 or xi >= w or yi < 0 or yi >= h:
-                continue
-
-            d = dist[yi, xi]
-            if d <= 0.6:
-                continue
-
-            edge_norm = min(1.0, d / 5.0)
-            is_small = random.random() < ratio
-
-            r = radius * (random.uniform(0.5, 0.8) if is_small else random.uniform(1.1, 1.6))
-            r *= (0.6 + 0.4 * edge_norm)
-            r *= scale
-            r = min(r, (d - 0.6) * scale)
+    print(f"Saved image to: {output_path}")
 
-            if r <= 0.6 * scale:
-                continue
+    if show:
+        out.show()
 
-            if shape == "square":
-                draw.rounded_rectangle(
-                    (x - r, y - r, x + r, y + r),
-                    radius=0.25 * r,
-                    fill=colour
-                )
-            else:
-                draw.ellipse(
-                    (x - r, y - r, x + r, y + r),
-                    fill=colour
-                )
\ No newline at end of file
+    if return_index:
+        return DotIndex(np.array(record, dtype=DOT_DTYPE))
@@ -0,0 +1,221 @@
+from PIL import Image, ImageDraw
+import numpy as np
+
+from .dots import RULE_COLOURS, RULES, CounterRNG, _dist_cap, _downsample, _place_labelled, _restore_cached, distance_field
+from .flexible import hex_to_rgb
+from .spatial import DotIndex
+from .vector import VectorImage
+
+
+def _as_rgb(colour):
+    if isinstance(colour, str):
+        return hex_to_rgb(colour)
+    return tuple(int(c) for c in colour)
+
+
+def _resolve(spec):
+    # Split a layer's `match` into a target colour or a mask function, and
+    # settle the colour its dots are drawn in
+    match = spec["match"]
+
+    if callable(match):
+        target, rule = None, match
+    elif isinstance(match, str) and match in RULES:
+        target, rule = None, RULES[match]
+    else:
+        target, rule = _as_rgb(match), None
+
+    colour = spec.get("colour")
+    if colour is None:
+        colour = target if target is not None else RULE_COLOURS.get(match)
+    if colour is None:
+        raise ValueError("Layers matched by a function need a colour")
+
+    return target, rule, _as_rgb(colour)
+
+
+# --------------------------------------------------
+# Labelling
+# --------------------------------------------------
+def classify(arr, layers):
+    """
+    Label every pixel with the layer it belongs to, in one pass.
+
+    Returns the layers sorted by `z` (lowest, drawn first, at index 0) and a
+    uint8 label map holding 0 for unclaimed pixels and i + 1 for the i-th
+    sorted layer. Pixels close enough to several target colours go to the
+    nearest one; colour targets take precedence over rules and functions,
+    which are applied in order.
+    """
+    if len(layers) > 254:
+        raise ValueError("At most 254 layers are supported")
+
+    ordered = sorted(layers, key=lambda spec: spec.get("z", 0))
+    resolved = [_resolve(spec) for spec in ordered]
+
+    h, w = arr.shape[:2]
+    label = np.zeros((h, w), dtype=np.uint8)
+
+    # -------------------------
+    # Colour targets: nearest within tolerance
+    # -------------------------
+    targeted = [i for i, (target, _, _) in enumerate(resolved) if target is not None]
+
+    if targeted:
+        targets = np.array([resolved[i][0] for i in targeted], dtype=np.int32)
+        limits = np.array([ordered[i].get("tolerance", 40) for i in targeted], dtype=np.float64) ** 2
+
+        diff = arr[:, :, None, :3].astype(np.int32) - targets
+        dist2 = np.einsum("hwkc,hwkc->hwk", diff, diff)
+
+        nearest = dist2.argmin(axis=2)
+        within = np.take_along_axis(dist2, nearest[..., None], axis=2)[..., 0] <= limits[nearest]
+
+        label[within] = np.array(targeted, dtype=np.uint8)[nearest[within]] + 1
+
+    # -------------------------
+    # Rules and functions
+    # -------------------------
+    for i, (target, rule, _) in enumerate(resolved):
+        if rule is not None:
+            label[rule(arr) & (label == 0)] = i + 1
+
+    return ordered, label
+
+
+def layers(arr, layers):
+    ordered, label = classify(arr, layers)
+    return [
+        (label == i + 1, _resolve(spec)[2], spec["dots"])
+        for i, spec in enumerate(ordered)
+    ]
+
+
+# --------------------------------------------------
+# Main generator
+# --------------------------------------------------
+def generate(
+    img,
+    output_path,
+    layers,
+    background="#000000",
+    scale=3,
+    resample="lanczos",
+    show=True,
+    seed=None,
+    variant=0,
+    cache=None,
+    return_index=False,
+):
+    """
+    Render any number of dot layers in one pass.
+
+    Each layer is a dict with:
+        match:      the input colour it replaces (HEX or RGB, matched within
+                    `tolerance`), a named rule ("red", "blue", "green",
+                    "grey"), or a function mapping the RGB array to a mask
+        colour:     the colour its dots are drawn in (defaults to `match`)
+        dots:       its dot parameters, as for the two-colour modes
+        z:          its depth order; higher layers are drawn on top
+        tolerance:  the RGB distance allowed when `match` is a colour
+
+    `img` may also be a VectorImage, whose shapes are assigned to layers by
+    their fill colours. With `return_index`, a DotIndex over the placed
+    dots is returned.
+    """
+
+    # -------------------------
+    # Cached result
+    # -------------------------
+    key, hit, index = _restore_cached(
+        cache,
+        img,
+        "layered",
+        output_path,
+        seed,
+        variant,
+        show,
+        return_index,
+        dict(background=background, scale=scale, resample=resample),
+        layers=layers,
+    )
+    if hit:
+        return index
+
+    rng = CounterRNG(seed, variant)
+
+    # -------------------------
+    # Load image & label layers
+    # -------------------------
+    w, h = img.size
+
+    if isinstance(img, VectorImage):
+        layer_list = img.layers("layered", layers=layers)
+
+        label = np.zeros((h, w), dtype=np.uint8)
+        for i, (mask, _, _) in enumerate(layer_list):
+            label[mask] = i + 1
+
+        colours = [colour for _, colour, _ in layer_list]
+        dots_list = [dots for _, _, dots in layer_list]
+    else:
+        ordered, label = classify(np.asarray(img), layers)
+        dots_list = [spec["dots"] for spec in ordered]
+        colours = [_resolve(spec)[2] for spec in ordered]
+
+    fields = [
+        distance_field(label == i + 1, cap=_dist_cap(dots["radius"]))
+        for i, dots in enumerate(dots_list)
+    ]
+
+    # -------------------------
+    # Place dots for every layer
+    # -------------------------
+    placed = _place_labelled(label, fields, dots_list, rng)
+    placed["colour"] = np.array(colours, dtype=np.uint8)[placed["layer"]]
+
+    # -------------------------
+    # Composite in z-order
+    # -------------------------
+    out_hi = Image.new(
+        "RGB",
+        (w * scale, h * scale),
+        _as_rgb(background)
+    )
+    draw = ImageDraw.Draw(out_hi)
+
+    for x, y, r, layer, square in zip(
+        placed["x"] * scale,
+        placed["y"] * scale,
+        placed["r"] * scale,
+        placed["layer"],
+        placed["square"],
+    ):
+        if square:
+            draw.rounded_rectangle(
+                (x - r, y - r, x + r, y + r),
+                radius=0.25 * r,
+                fill=colours[layer]
+            )
+        else:
+            draw.ellipse(
+                (x - r, y - r, x + r, y + r),
+                fill=colours[layer]
+            )
+
+    # -------------------------
+    # Downsample & save
+    # -------------------------
+    out = _downsample(out_hi, scale, resample)
+    out.save(output_path)
+
+    if key is not None:
+        cache.store(key, output_path)
+
+    print(f"Saved image to: {output_path}")
+
+    if show:
+        out.show()
+
+    if return_index:
+        return DotIndex(placed)
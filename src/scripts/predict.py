@@ -0,0 +1,201 @@
+import numpy as np
+
+from .dots import DIST_QUANTUM, _dist_cap, distance_field, mode_layers, stimulus_layers
+
+
+# Resolution of the distance histogram, in pixels
+BIN_WIDTH = 0.125
+
+# Quadrature points used for the jitter offset and the radius draw
+_JITTER_POINTS = (np.arange(8) + 0.5) / 8 * 2 - 1
+_SIZE_POINTS = (np.arange(16) + 0.5) / 16
+
+
+# --------------------------------------------------
+# Distance histogram
+# --------------------------------------------------
+def _selection_histogram(mask, dist, density):
+    """
+    Histogram over distance of the expected number of cells picking a pixel
+    at that distance: each non-empty cell picks one of its n pixels, so each
+    pixel carries a weight of 1/n. Bins are BIN_WIDTH wide, the last one
+    collecting every distance at the field's cap.
+    """
+    h, w = mask.shape
+    rows = np.arange(0, h, density)
+    cols = np.arange(0, w, density)
+    counts = np.add.reduceat(np.add.reduceat(mask, rows, axis=0, dtype=np.int64), cols, axis=1)
+
+    ys, xs = np.nonzero(mask)
+    weights = 1.0 / counts[ys // density, xs // density]
+
+    d = dist[ys, xs].astype(np.float32)
+    if dist.dtype == np.uint8:
+        d *= DIST_QUANTUM
+
+    hist = np.bincount((d / BIN_WIDTH).astype(np.int64), weights=weights)
+    return hist, int((counts > 0).sum())
+
+
+# --------------------------------------------------
+# Expected dot statistics
+# --------------------------------------------------
+def _dot_area(r, shape, scale):
+    # PIL fills whole pixels of the supersampled canvas, which adds about
+    # half a canvas pixel to every drawn radius
+    r = r + 0.5 / scale
+    if shape == "square":
+        return 4 * r ** 2 - (4 - np.pi) * (0.25 * r) ** 2
+    return np.pi * r ** 2
+
+
+def _expected(hist, centres, cap, radius, jitter, ratio, shape, scale, radius_bins):
+    # Distance after jitter: shifting by up to `jitter` moves the sample
+    # roughly as far towards or away from the nearest edge. Distances at the
+    # cap stay there, as they are interior pixels.
+    d = centres[:, None] + jitter * _JITTER_POINTS[None, :]
+    d = np.where(centres[:, None] >= cap, cap, np.clip(d, 0, cap))
+
+    edge_norm = np.minimum(1.0, d / 5.0)
+    base = radius * (0.6 + 0.4 * edge_norm)
+
+    small = 0.5 + 0.3 * _SIZE_POINTS
+    large = 1.1 + 0.5 * _SIZE_POINTS
+    factors = np.concatenate([small, large])
+    probs = np.concatenate([
+        np.full(small.size, ratio / small.size),
+        np.full(large.size, (1 - ratio) / large.size),
+    ])
+
+    r = np.minimum(base[..., None] * factors, d[..., None] - 0.6)
+    alive = (d[..., None] > 0.6) & (r > 0.6)
+
+    # Weight of every (distance bin, jitter point, size draw) outcome
+    weight = (
+        hist[:, None, None]
+        * (1 / _JITTER_POINTS.size)
+        * probs[None, None, :]
+        * alive
+    )
+
+    dots = weight.sum()
+    area = (weight * _dot_area(r, shape, scale)).sum()
+    mean_radius = (weight * r).sum() / dots if dots else 0.0
+    small_fraction = weight[..., :small.size].sum() / dots if dots else 0.0
+    sizes, _ = np.histogram(r, bins=radius_bins, weights=weight)
+
+    return dots, area, mean_radius, small_fraction, sizes
+
+
+def predict_layer(mask, radius, density, jitter, ratio, shape="circle", scale=3, dist=None, _hist=None):
+    """
+    Predict the dots of one layer without placing or drawing any.
+
+    Returns a dict with the expected number of dots, the fraction of the
+    mask they cover (overlaps are ignored, so this is an upper bound for
+    dense layouts), the mean radius and share of small dots, and the
+    expected radius histogram as `(counts, edges)` in input-image pixels.
+    A distance field from `distance_field`, capped at least as high as the
+    layer's own cap, can be passed as `dist` to reuse it.
+    """
+    cap = _dist_cap(radius)
+    if _hist is None:
+        if dist is None:
+            dist = distance_field(mask, cap=cap)
+        _hist = _selection_histogram(mask, dist, density)
+
+    hist, cells = _hist
+    nbins = int(np.ceil(cap / BIN_WIDTH)) + 1
+    hist = np.concatenate([hist[:nbins - 1], [hist[nbins - 1:].sum()]])
+    centres = np.minimum((np.arange(nbins) + 0.5) * BIN_WIDTH, cap)
+
+    edges = np.linspace(0, 1.6 * radius, 33)
+    dots, area, mean_radius, small_fraction, sizes = _expected(
+        hist, centres, cap, radius, jitter, ratio, shape, scale, edges
+    )
+
+    pixels = int(mask.sum())
+    return {
+        "cells": cells,
+        "dots": float(dots),
+        "coverage": min(1.0, float(area / pixels)) if pixels else 0.0,
+        "mean_radius": float(mean_radius),
+        "small_fraction": float(small_fraction),
+        "radius_hist": (sizes, edges),
+    }
+
+
+def predict(img, mode, **options):
+    """Predict the dots of every layer of a mode, in drawing order."""
+    return [
+        predict_layer(mask, **dots)
+        for mask, _, dots in stimulus_layers(img, mode, **options)
+    ]
+
+
+# --------------------------------------------------
+# Parameter solver
+# --------------------------------------------------
+DEFAULT_BOUNDS = {
+    "density": (2, 40),
+    "radius": (0.5, 6.0),
+    "ratio": (0.0, 1.0),
+    "jitter": (0.0, 2.0),
+}
+
+
+def solve(img, mode, layer, target, value, param="density", bounds=None, **options):
+    """
+    Choose one dot parameter of one layer so that its predicted `target`
+    ("dots", "coverage", "mean_radius" or "small_fraction") is as close as
+    possible to `value`.
+
+    `layer` is the layer's index in drawing order, `param` the parameter to
+    vary within `bounds` (see DEFAULT_BOUNDS), and `options` the mode's own
+    keyword arguments. Returns a copy of that layer's dot dict with the
+    solved parameter filled in.
+    """
+    if param not in DEFAULT_BOUNDS:
+        raise ValueError(f"Cannot solve for parameter: {param}")
+
+    lo, hi = bounds if bounds is not None else DEFAULT_BOUNDS[param]
+
+    arr = np.array(img)
+    mask, _, dots = mode_layers(arr, mode, **options)[layer]
+    dots = dict(dots)
+
+    # One distance field, capped for the largest radius tried, serves all
+    radius_max = hi if param == "radius" else dots["radius"]
+    dist = distance_field(mask, cap=_dist_cap(radius_max))
+
+    # The distance histogram only depends on the cell size
+    hists = {}
+
+    def error(x):
+        trial = dict(dots, **{param: x})
+        density = trial["density"]
+        if density not in hists:
+            hists[density] = _selection_histogram(mask, dist, density)
+        return predict_layer(mask, _hist=hists[density], **trial)[target] - value
+
+    # Bisection, assuming the target is monotonic in the parameter
+    integer = param == "density"
+    if integer:
+        lo, hi = int(lo), int(hi)
+
+    e_lo, e_hi = error(lo), error(hi)
+
+    if np.sign(e_lo) != np.sign(e_hi):
+        for _ in range(40):
+            if integer and hi - lo <= 1:
+                break
+
+            mid = (lo + hi) // 2 if integer else (lo + hi) / 2
+            e_mid = error(mid)
+            if np.sign(e_mid) == np.sign(e_lo):
+                lo, e_lo = mid, e_mid
+            else:
+                hi, e_hi = mid, e_mid
+
+    dots[param] = lo if abs(e_lo) <= abs(e_hi) else hi
+    return dots
@@ -0,0 +1,125 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+
+from .renderer import Renderer
+
+
+# --------------------------------------------------
+# Worker-side rendering
+# --------------------------------------------------
+_worker_renderer = None
+
+
+def _init_worker(renderer):
+    global _worker_renderer
+    _worker_renderer = renderer
+
+
+def _render_variant():
+    return _worker_renderer.render()
+
+
+# --------------------------------------------------
+# Prefetch pool
+# --------------------------------------------------
+class VariantPool:
+    """
+    Keep a bounded queue of freshly rendered variants of one stimulus.
+
+    Masks and distance fields are computed once, up front, and shared with
+    `workers` background processes (or threads, with `processes=False`)
+    that keep up to `size` variants rendered ahead. `get` hands out a
+    finished variant and immediately queues a replacement, so trial code
+    never waits on the renderer as long as it consumes no faster than the
+    workers produce.
+
+    Processes avoid competing with the display loop for the GIL, but, as
+    with any multiprocessing code, the pool must then be created under an
+    `if __name__ == "__main__":` guard on platforms that spawn workers.
+
+    `options` are the mode's own keyword arguments, e.g. `red_dots` and
+    `blue_dots` for "red-blue".
+    """
+
+    def __init__(
+        self,
+        img,
+        mode,
+        size=8,
+        workers=1,
+        processes=True,
+        scale=3,
+        resample="lanczos",
+        **options,
+    ):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+
+        self.size = size
+
+        self._renderer = Renderer(mode, img.size, scale, resample, **options)
+        self._renderer.prepare(img)
+
+        if processes:
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(self._renderer,),
+            )
+            self._task = _render_variant
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+            self._local = threading.local()
+            self._task = self._render_in_thread
+
+        self._pending = deque(self._executor.submit(self._task) for _ in range(size))
+
+    def _render_in_thread(self):
+        renderer = getattr(self._local, "renderer", None)
+        if renderer is None:
+            renderer = self._local.renderer = self._renderer.fork()
+        return renderer.render()
+
+    def ready(self):
+        """Number of variants rendered and waiting to be taken."""
+        return sum(future.done() for future in self._pending)
+
+    def get(self, timeout=None):
+        """
+        Return a rendered variant, preferring one that is already finished.
+        Blocks for up to `timeout` seconds (forever if None) when none is.
+        """
+        if self._executor is None:
+            raise RuntimeError("VariantPool is closed")
+
+        for future in self._pending:
+            if future.done():
+                break
+        else:
+            future = self._pending[0]
+
+        # Wait without raising a failed render's error yet, then replace the
+        # finished future first, so a failure is only reported once
+        future.exception(timeout)
+
+        self._pending.remove(future)
+        self._pending.append(self._executor.submit(self._task))
+        return future.result()
+
+    def close(self):
+        if self._executor is None:
+            return
+
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
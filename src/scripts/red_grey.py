@@ -1,7 +1,22 @@
 from PIL import Image, ImageDraw
 import numpy as np
-import random
-from scipy.ndimage import distance_transform_edt
+
+from .dots import DOT_DTYPE, RULE_COLOURS, RULES, CounterRNG, _downsample, _render_dots, _restore_cached, stimulus_layers
+from .spatial import DotIndex
+
+
+def layers(arr, red_dots, grey_dots):
+
+    # -------------------------
+    # Colour masks
+    # -------------------------
+    red_mask = RULES["red"](arr)
+    grey_mask = RULES["grey"](arr)
+
+    return [
+        (grey_mask, RULE_COLOURS["grey"], grey_dots),
+        (red_mask, RULE_COLOURS["red"], red_dots),
+    ]
 
 
 def generate(
@@ -10,39 +25,50 @@ def generate(
     red_dots,
     grey_dots,
     scale=3,
+    resample="lanczos",
+    show=True,
+    seed=None,
+    variant=0,
+    cache=None,
+    return_index=False,
 ):
 
-    random.seed()
-
     # -------------------------
-    # Load image
+    # Cached result
     # -------------------------
-    arr = np.array(img)
-    h, w, _ = arr.shape
+    key, hit, index = _restore_cached(
+        cache,
+        img,
+        "red-grey",
+        output_path,
+        seed,
+        variant,
+        show,
+        return_index,
+        dict(scale=scale, resample=resample),
+        red_dots=red_dots,
+        grey_dots=grey_dots,
+    )
+    if hit:
+        return index
+
+    rng = CounterRNG(seed, variant)
+    record = [] if return_index else None
 
     # -------------------------
-    # Colour masks
+    # Load image
     # -------------------------
-    red_mask = (
-        (arr[:, :, 0] > 150) &
-        (arr[:, :, 0] > arr[:, :, 1] + 40) &
-        (arr[:, :, 0] > arr[:, :, 2] + 40)
-    )
+    w, h = img.size
 
-    grey_mask = (
-        (np.abs(arr[:, :, 0] - arr[:, :, 1]) < 5) &
-        (np.abs(arr[:, :, 0] - arr[:, :, 2]) < 5) &
-        (arr[:, :, 0] > 50) &
-        (arr[:, :, 0] < 150)
-    )
+    layer_list = stimulus_layers(img, "red-grey", red_dots=red_dots, grey_dots=grey_dots)
 
     # -------------------------
     # High-resolution canvas
     # -------------------------
     out_hi = Image.new(
-        "RGBA",
+        "RGB",
         (w * scale, h * scale),
-        (0, 0, 0, 255)
+        (0, 0, 0)
     )
     draw = ImageDraw.Draw(out_hi)
 
@@ -52,10 +78,7 @@ def generate(
     def cells(density):
         return ((h + density - 1) // density) * ((w + density - 1) // density)
 
-    total_work = (
-        cells(grey_dots["density"]) +
-        cells(red_dots["density"])
-    )
+    total_work = sum(cells(dots["density"]) for _, _, dots in layer_list)
 
     progress = {
         "done": 0,
@@ -65,113 +88,35 @@ def generate(
     # -------------------------
     # Render dot layers
     # -------------------------
-    _render_dots(
-        draw=draw,
-        mask=grey_mask,
-        colour=(96, 96, 96),
-        scale=scale,
-        h=h,
-        w=w,
-        progress=progress,
-        total_work=total_work,
-        **grey_dots,
-    )
-
-    _render_dots(
-        draw=draw,
-        mask=red_mask,
-        colour=(255, 0, 0),
-        scale=scale,
-        h=h,
-        w=w,
-        progress=progress,
-        total_work=total_work,
-        **red_dots,
-    )
+    for layer, (mask, colour, dots) in enumerate(layer_list):
+        _render_dots(
+            draw=draw,
+            mask=mask,
+            colour=colour,
+            scale=scale,
+            h=h,
+            w=w,
+            progress=progress,
+            total_work=total_work,
+            rng=rng,
+            layer=layer,
+            record=record,
+            **dots,
+        )
 
     # -------------------------
     # Downsample & save
     # -------------------------
-    out = out_hi.resize((w, h), Image.LANCZOS).convert("RGB")
+    out = _downsample(out_hi, scale, resample)
     out.save(output_path)
 
-    print(f"Saved image to: {output_path}")
-    out.show()
-
-
-def _render_dots(
-    draw,
-    mask,
-    colour,
-    radius,
-    density,
-    jitter,
-    ratio,
-    shape,
-    scale,
-    h,
-    w,
-    progress,
-    total_work,
-):
-    dist = distance_transform_edt(mask)
-
-    for y0 in range(0, h, density):
-        for x0 in range(0, w, density):
-            progress["done"] += 1
-            percent = int((progress["done"] / total_work) * 100)
-
-            if percent % 5 == 0 and percent != progress["last_print"]:
-                print(f"Rendering: {percent}%")
-                progress["last_print"] = percent
-
-            y1 = min(y0 + density, h)
-            x1 = min(x0 + density, w)
-
-            cell = mask[y0:y1, x0:x1]
-            if not cell.any():
-                continue
-
-            ys, xs = np.where(cell)
-            i = random.randrange(len(xs))
+    if key is not None:
+        cache.store(key, output_path)
 
-            x = (x0 + xs[i] + random.uniform(-jitter, jitter)) * scale
-            y = (y0 + ys[i] + random.uniform(-jitter, jitter)) * scale
-
-            xi = int(round(x / scale))
-            yi = int(round(y / scale))
-
-            if xi < 0 or xi >= w or yi < 0 or yi >= h:
-                continue
-
-            d = dist[yi, xi]
-            if d <= 0.6:
-                continue
-
-            edge_norm = min(1.0, d / 5.0)
-            is_small = random.random() < ratio
-
-            if is_small:
-                r = radius * random.uniform(0.5, 0.8)
-            else:
-                r = radius * random.uniform(1.1, 1.6)
-
-            r *= (0.6 + 0.4 * edge_norm)
-
-            r *= scale
-            r = min(r, (d - 0.6) * scale)
+    print(f"Saved image to: {output_path}")
 
-            if r <= 0.6 * scale:
-                continue
+    if show:
+        out.show()
 
-            if shape == "square":
-                draw.rounded_rectangle(
-                    (x - r, y - r, x + r, y + r),
-                    radius=0.25 * r,
-                    fill=colour
-                )
-            else:
-                draw.ellipse(
-                    (x - r, y - r, x + r, y + r),
-                    fill=colour
-                )
\ No newline at end of file
+    if return_index:
+        return DotIndex(np.array(record, dtype=DOT_DTYPE))
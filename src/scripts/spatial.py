@@ -0,0 +1,165 @@
+from itertools import chain
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .dots import DOT_DTYPE, iter_dots
+
+
+def _points(points):
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 2:
+        points = points.reshape(-1, 2)
+    return points
+
+
+def _flatten(neighbours):
+    # query_ball_point lists -> parallel (query, dot) index arrays
+    counts = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(neighbours))
+    dots = np.fromiter(chain.from_iterable(neighbours), dtype=np.int64, count=int(counts.sum()))
+    return np.repeat(np.arange(len(neighbours)), counts), dots
+
+
+# --------------------------------------------------
+# Dot index
+# --------------------------------------------------
+class DotIndex:
+    """
+    Spatial index over the placed dots of one stimulus.
+
+    `dots` is a DOT_DTYPE array in drawing order, as returned by
+    `generate(..., return_index=True)` or `iter_dots`. Positions are in
+    output-image pixels, pixel (row i, column j) spanning [j, j + 1) in x
+    and [i, i + 1) in y. Every query takes an (n, 2) array of (x, y)
+    points, returns indices into `dots`, and can be restricted to one
+    `layer` (in drawing order).
+    """
+
+    def __init__(self, dots):
+        self.dots = np.asarray(dots, dtype=DOT_DTYPE)
+        self._trees = {}
+
+    def __len__(self):
+        return len(self.dots)
+
+    def _tree(self, layer):
+        # One KD-tree for all dots and one per layer, built on first use
+        if layer not in self._trees:
+            if layer is None:
+                ids = np.arange(len(self.dots))
+            else:
+                ids = np.flatnonzero(self.dots["layer"] == layer)
+
+            xy = np.column_stack([self.dots["x"][ids], self.dots["y"][ids]]).astype(np.float64)
+            reach = float(self.dots["r"][ids].max()) if ids.size else 0.0
+            self._trees[layer] = (cKDTree(xy.reshape(-1, 2)), ids, reach)
+
+        return self._trees[layer]
+
+    # -------------------------
+    # Queries
+    # -------------------------
+    def nearest(self, points, k=1, layer=None, max_distance=np.inf):
+        """
+        The `k` dots whose centres are nearest each point. Returns
+        (distances, indices) of shape (n,) for k=1, else (n, k); missing
+        neighbours have an infinite distance and index -1.
+        """
+        points = _points(points)
+        tree, ids, _ = self._tree(layer)
+
+        if not ids.size:
+            shape = (len(points),) if k == 1 else (len(points), k)
+            return np.full(shape, np.inf), np.full(shape, -1, dtype=np.int64)
+
+        dist, found = tree.query(points, k=k, distance_upper_bound=max_distance)
+        missing = found == ids.size
+        indices = np.where(missing, -1, ids[np.minimum(found, ids.size - 1)])
+        return dist, indices
+
+    def within_radius(self, points, radius, layer=None, from_edge=False):
+        """
+        All dots within `radius` of each point, measured to their centres or,
+        with `from_edge`, to their outlines. Returns parallel (point, dot)
+        index arrays with one entry per match.
+        """
+        points = _points(points)
+        tree, ids, reach = self._tree(layer)
+
+        if not ids.size:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        query, found = _flatten(tree.query_ball_point(points, radius + reach if from_edge else radius))
+        dots = ids[found]
+
+        if from_edge:
+            d = np.hypot(self.dots["x"][dots] - points[query, 0], self.dots["y"][dots] - points[query, 1])
+            keep = d - self.dots["r"][dots] <= radius
+            query, dots = query[keep], dots[keep]
+
+        return query, dots
+
+    def in_region(self, x0, y0, x1, y1, layer=None):
+        """Indices of the dots whose centres lie in the rectangle [x0, x1) x [y0, y1)."""
+        tree, ids, _ = self._tree(layer)
+
+        centre = ((x0 + x1) / 2, (y0 + y1) / 2)
+        half = max(x1 - x0, y1 - y0) / 2
+        found = ids[np.asarray(tree.query_ball_point(centre, half, p=np.inf), dtype=np.int64)]
+
+        x, y = self.dots["x"][found], self.dots["y"][found]
+        return np.sort(found[(x >= x0) & (x < x1) & (y >= y0) & (y < y1)])
+
+    def hit(self, points, layer=None):
+        """
+        The dot drawn at each point: the topmost dot whose shape contains it,
+        or -1 where the background shows.
+        """
+        points = _points(points)
+        tree, ids, reach = self._tree(layer)
+        result = np.full(len(points), -1, dtype=np.int64)
+
+        if not ids.size:
+            return result
+
+        # Squares reach furthest along their diagonals
+        query, found = _flatten(tree.query_ball_point(points, reach * np.sqrt(2)))
+        dots = ids[found]
+
+        dx = np.abs(points[query, 0] - self.dots["x"][dots])
+        dy = np.abs(points[query, 1] - self.dots["y"][dots])
+        r = self.dots["r"][dots].astype(np.float64)
+
+        # Squares are drawn with corners rounded to a quarter of their radius
+        corner = 0.75 * r
+        square = (dx <= r) & (dy <= r) & (
+            (dx <= corner) | (dy <= corner) | (np.hypot(dx - corner, dy - corner) <= 0.25 * r)
+        )
+        circle = np.hypot(dx, dy) <= r
+        inside = np.where(self.dots["square"][dots], square, circle)
+
+        # Later dots are drawn over earlier ones
+        np.maximum.at(result, query[inside], dots[inside])
+        return result
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def save(self, path):
+        np.save(path, self.dots)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+
+def index_dots(img, mode, seed=None, variant=0, **options):
+    """
+    Index the dots of a stimulus without drawing it. With the `seed` and
+    `variant` it was rendered with, this recovers the dots of any earlier
+    render.
+    """
+    return DotIndex(np.concatenate(
+        list(iter_dots(img, mode, seed=seed, variant=variant, **options))
+        or [np.empty(0, dtype=DOT_DTYPE)]
+    ))
@@ -0,0 +1,397 @@
+import math
+import re
+import xml.etree.ElementTree as ET
+
+from PIL import Image, ImageColor
+import numpy as np
+
+from .dots import mode_module
+
+
+# --------------------------------------------------
+# Colours
+# --------------------------------------------------
+def _parse_fill(fill):
+    # HEX ("#rgb" or "#rrggbb"), "rgb(r, g, b)", a CSS colour name or an RGB
+    # tuple; None for "none"
+    if fill is None or (isinstance(fill, str) and fill.strip().lower() in ("none", "transparent")):
+        return None
+
+    if not isinstance(fill, str):
+        return tuple(int(c) for c in fill[:3])
+
+    text = fill.strip()
+    match = re.fullmatch(r"rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)", text)
+    if match:
+        return tuple(int(c) for c in match.groups())
+
+    if text.lower() in ImageColor.colormap:
+        return ImageColor.getrgb(text.lower())[:3]
+
+    text = text.lstrip("#")
+    if re.fullmatch(r"[0-9a-fA-F]{3}", text):
+        text = "".join(c * 2 for c in text)
+    if not re.fullmatch(r"[0-9a-fA-F]{6}", text):
+        raise ValueError(f"Unsupported fill colour: {fill}")
+    return tuple(int(text[i:i+2], 16) for i in (0, 2, 4))
+
+
+# --------------------------------------------------
+# Geometry
+# --------------------------------------------------
+_GEOMETRY = ("points", "rect", "circle", "ellipse")
+
+_SVG_SHAPES = ("path", "polygon", "rect", "circle", "ellipse")
+
+# Elements whose children are never drawn in place
+_SVG_UNDRAWN = ("defs", "clipPath", "mask", "marker", "pattern", "symbol")
+
+_PATH_TOKEN = re.compile(r"[MmLlHhVvCcQqZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+def _bezier(points, length):
+    # Flatten a quadratic or cubic Bezier curve into segments about a pixel long
+    n = int(min(max(math.ceil(length), 2), 1024))
+    t = np.linspace(0, 1, n + 1)[1:, None]
+    p = np.asarray(points, dtype=np.float64)
+
+    if len(p) == 3:
+        return (1 - t) ** 2 * p[0] + 2 * (1 - t) * t * p[1] + t ** 2 * p[2]
+    return (1 - t) ** 3 * p[0] + 3 * (1 - t) ** 2 * t * p[1] + 3 * (1 - t) * t ** 2 * p[2] + t ** 3 * p[3]
+
+
+def parse_path(d, unit=1.0):
+    """
+    Split SVG path data into closed polygons, one per subpath. Supports the
+    M, L, H, V, C, Q and Z commands in absolute and relative form; curves
+    are flattened into segments about 1/`unit` long.
+    """
+    tokens = _PATH_TOKEN.findall(d)
+    subpaths = []
+    current = []
+    pos = np.zeros(2)
+    start = np.zeros(2)
+    command = None
+    i = 0
+
+    def numbers(count):
+        nonlocal i
+        chunk = tokens[i:i + count]
+        if len(chunk) < count or any(t.isalpha() for t in chunk):
+            raise ValueError(f"Malformed path data: {d}")
+        i += count
+        return [float(v) for v in chunk]
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+        elif command is None:
+            raise ValueError(f"Path data must start with a command: {d}")
+
+        relative = command.islower()
+        offset = pos if relative else np.zeros(2)
+        op = command.upper()
+
+        if op == "Z":
+            if len(current) > 2:
+                subpaths.append(np.array(current))
+            current = []
+            pos = start.copy()
+            command = None
+            continue
+
+        if op == "M":
+            if len(current) > 2:
+                subpaths.append(np.array(current))
+            pos = offset + numbers(2)
+            start = pos.copy()
+            current = [pos]
+            # Further coordinate pairs are implicit line-tos
+            command = "l" if relative else "L"
+        elif op == "L":
+            pos = offset + numbers(2)
+            current.append(pos)
+        elif op == "H":
+            x, = numbers(1)
+            pos = np.array([x + (pos[0] if relative else 0), pos[1]])
+            current.append(pos)
+        elif op == "V":
+            y, = numbers(1)
+            pos = np.array([pos[0], y + (pos[1] if relative else 0)])
+            current.append(pos)
+        elif op in "CQ":
+            count = 3 if op == "C" else 2
+            controls = [offset + numbers(2) for _ in range(count)]
+            points = [pos] + controls
+            length = sum(np.hypot(*(b - a)) for a, b in zip(points, points[1:])) * unit
+            current.extend(_bezier(points, length))
+            pos = controls[-1]
+
+    if len(current) > 2:
+        subpaths.append(np.array(current))
+
+    return subpaths
+
+
+def _ellipse(cx, cy, rx, ry, unit):
+    # Enough vertices to keep the polygon within 0.05 px of the true outline
+    r = max(rx, ry) * unit
+    n = 16 if r <= 0.05 else max(16, math.ceil(math.pi / math.acos(1 - 0.05 / r)))
+    t = np.linspace(0, 2 * math.pi, n, endpoint=False)
+    return [np.column_stack([cx + rx * np.cos(t), cy + ry * np.sin(t)])]
+
+
+def _edges(subpaths):
+    # (n, 4) array of (x0, y0, x1, y1), closing every subpath
+    if not subpaths:
+        return np.empty((0, 4))
+    return np.concatenate([
+        np.hstack([p, np.roll(p, -1, axis=0)])
+        for p in subpaths
+    ])
+
+
+def _rasterise(edges, h, w):
+    """
+    Even-odd fill of closed edges, sampled at pixel centres (pixel (i, j)
+    sits at x = j, y = i). Returns the bounding box (y0, y1, x0, x1) of the
+    covered pixels and the filled mask within it, or None.
+    """
+    if not edges.size:
+        return None
+
+    xs = edges[:, [0, 2]]
+    ys = edges[:, [1, 3]]
+
+    y0 = max(math.ceil(ys.min()), 0)
+    y1 = min(math.ceil(ys.max()), h)
+    x0 = max(math.ceil(xs.min()), 0)
+    x1 = min(math.floor(xs.max()) + 1, w)
+    if y0 >= y1 or x0 >= x1:
+        return None
+
+    # Every row an edge crosses, under the half-open rule ymin <= y < ymax
+    lo = np.clip(np.ceil(ys.min(axis=1)), y0, y1).astype(np.int64)
+    hi = np.clip(np.ceil(ys.max(axis=1)), y0, y1).astype(np.int64)
+    counts = hi - lo
+
+    which = np.repeat(np.arange(len(edges)), counts)
+    rows = lo[which] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    e = edges[which]
+    t = (rows - e[:, 1]) / (e[:, 3] - e[:, 1])
+    x = e[:, 0] + t * (e[:, 2] - e[:, 0])
+
+    # Pixels from the crossing onwards change side
+    cols = np.clip(np.ceil(x), x0, x1).astype(np.int64) - x0
+
+    toggles = np.zeros((y1 - y0, x1 - x0 + 1), dtype=np.uint8)
+    np.bitwise_xor.at(toggles, (rows - y0, cols), 1)
+    inside = np.bitwise_xor.accumulate(toggles[:, :-1], axis=1).astype(bool)
+
+    return (y0, y1, x0, x1), inside
+
+
+# --------------------------------------------------
+# Vector stimulus
+# --------------------------------------------------
+class VectorImage:
+    """
+    An input image defined by filled shapes instead of pixels.
+
+    `shapes` are dicts drawn in order, later shapes covering earlier ones,
+    each with a `fill` colour and one of:
+        points:  a polygon, as a list of (x, y) vertices
+        path:    SVG path data (M, L, H, V, C, Q and Z commands); several
+                 subpaths combine with the even-odd rule, so holes work
+        rect:    (x, y, width, height)
+        circle:  (cx, cy, r)
+        ellipse: (cx, cy, rx, ry)
+
+    Coordinates are in `viewbox` units, (x, y, width, height) defaulting
+    to the pixel `size` (width, height), with pixel centres at half
+    units as in SVG. Pass it to any mode's `generate()` in place of a PIL
+    image: shapes are rasterised exactly at the pixel size, and classified
+    into layers by their fill colours under the mode's own rules.
+    """
+
+    def __init__(self, shapes, size, viewbox=None, background="#000000"):
+        self.shapes = [dict(shape) for shape in shapes]
+        self.size = (int(size[0]), int(size[1]))
+        self.viewbox = tuple(viewbox) if viewbox is not None else (0, 0) + self.size
+        self.background = background
+
+        self._label = None
+
+    @classmethod
+    def from_svg(cls, path, size=None):
+        """
+        Read the filled path, polygon, rect, circle and ellipse elements of
+        an SVG file. Fills may be set by attribute or style, and inherited
+        from enclosing groups. Transforms, strokes and gradients are not
+        supported.
+        """
+        root = ET.parse(path).getroot()
+
+        def number(value):
+            return float(re.sub(r"[a-z%]+$", "", value.strip()))
+
+        viewbox = root.get("viewBox")
+        if viewbox:
+            viewbox = tuple(float(v) for v in re.split(r"[\s,]+", viewbox.strip()))
+        if size is None:
+            if root.get("width") and root.get("height"):
+                size = (round(number(root.get("width"))), round(number(root.get("height"))))
+            elif viewbox:
+                size = (round(viewbox[2]), round(viewbox[3]))
+            else:
+                raise ValueError("The SVG has no size; pass one")
+
+        shapes = []
+
+        def visit(element, fill):
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag in _SVG_UNDRAWN:
+                return
+            if element.get("transform"):
+                raise ValueError(f"Transformed SVG elements are not supported: <{tag}>")
+
+            # The style attribute overrides the fill attribute, and either
+            # overrides the fill inherited from the parent
+            style = {}
+            for item in element.get("style", "").split(";"):
+                if ":" in item:
+                    key, value = item.split(":", 1)
+                    style[key.strip()] = value.strip()
+
+            own = style.get("fill", element.get("fill"))
+            if own is not None and own.strip() != "inherit":
+                fill = own.strip()
+
+            if tag in _SVG_SHAPES and _parse_fill(fill) is not None:
+                get = lambda name: number(element.get(name, "0"))
+                if tag == "path":
+                    shapes.append({"path": element.get("d", ""), "fill": fill})
+                elif tag == "polygon":
+                    values = [float(v) for v in re.split(r"[\s,]+", element.get("points", "").strip()) if v]
+                    shapes.append({"points": list(zip(values[::2], values[1::2])), "fill": fill})
+                elif tag == "rect":
+                    shapes.append({"rect": (get("x"), get("y"), get("width"), get("height")), "fill": fill})
+                elif tag == "circle":
+                    shapes.append({"circle": (get("cx"), get("cy"), get("r")), "fill": fill})
+                else:
+                    shapes.append({"ellipse": (get("cx"), get("cy"), get("rx"), get("ry")), "fill": fill})
+
+            for child in element:
+                visit(child, fill)
+
+        # SVG fills default to black
+        visit(root, "#000000")
+
+        return cls(shapes, size, viewbox=viewbox)
+
+    # -------------------------
+    # Geometry in pixels
+    # -------------------------
+    def _subpaths(self, shape):
+        vx, vy, vw, vh = self.viewbox
+        w, h = self.size
+        sx, sy = w / vw, h / vh
+
+        if "points" in shape:
+            subpaths = [np.asarray(shape["points"], dtype=np.float64)]
+        elif "path" in shape:
+            subpaths = parse_path(shape["path"], unit=max(sx, sy))
+        elif "rect" in shape:
+            x, y, rw, rh = shape["rect"]
+            subpaths = [np.array([[x, y], [x + rw, y], [x + rw, y + rh], [x, y + rh]], dtype=np.float64)]
+        elif "circle" in shape:
+            cx, cy, r = shape["circle"]
+            subpaths = _ellipse(cx, cy, r, r, max(sx, sy))
+        elif "ellipse" in shape:
+            subpaths = _ellipse(*shape["ellipse"], max(sx, sy))
+        else:
+            raise ValueError(f"Shape has no geometry: {shape}")
+
+        # Pixel centres sit at integer coordinates
+        return [(p - (vx, vy)) * (sx, sy) - 0.5 for p in subpaths]
+
+    def _build(self):
+        if self._label is not None:
+            return
+
+        w, h = self.size
+
+        # Index of the topmost shape at every pixel, -1 for background
+        label = np.full((h, w), -1, dtype=np.int32)
+        for i, shape in enumerate(self.shapes):
+            # Unfilled shapes are invisible
+            if _parse_fill(shape.get("fill")) is None:
+                continue
+
+            filled = _rasterise(_edges(self._subpaths(shape)), h, w)
+            if filled is None:
+                continue
+            (y0, y1, x0, x1), inside = filled
+            label[y0:y1, x0:x1][inside] = i
+
+        self._label = label
+
+    def _fills(self):
+        # One row of every shape's fill, then the background
+        fills = [_parse_fill(shape.get("fill")) or (0, 0, 0) for shape in self.shapes]
+        return np.array([fills + [_parse_fill(self.background)]], dtype=np.uint8)
+
+    # -------------------------
+    # Image interface
+    # -------------------------
+    def __array__(self, dtype=None, copy=None):
+        self._build()
+        arr = self._fills()[0][self._label]  # -1 picks the background
+        return arr if dtype is None else arr.astype(dtype)
+
+    def to_image(self):
+        return Image.fromarray(np.asarray(self))
+
+    def spec(self):
+        """
+        A JSON-serialisable description identifying the image in cache keys,
+        with geometry as plain lists of floats and fills as RGB lists.
+        """
+        shapes = []
+        for shape in self.shapes:
+            plain = {
+                key: np.asarray(shape[key], dtype=np.float64).tolist()
+                for key in _GEOMETRY
+                if key in shape
+            }
+            if "path" in shape:
+                plain["path"] = str(shape["path"])
+
+            fill = _parse_fill(shape.get("fill"))
+            plain["fill"] = list(fill) if fill is not None else None
+            shapes.append(plain)
+
+        return {
+            "shapes": shapes,
+            "size": list(self.size),
+            "viewbox": [float(v) for v in self.viewbox],
+            "background": list(_parse_fill(self.background) or (0, 0, 0)),
+        }
+
+    def layers(self, mode, **options):
+        """
+        The (mask, colour, dots) layers of `mode` for this image, in drawing
+        order. Masks come straight from the rasterised shapes; no RGB image
+        is built or thresholded.
+        """
+        self._build()
+
+        # Classify each fill once with the mode's own colour rules
+        fills = self._fills()
+        return [
+            # Background pixels (-1) index the background's entry, last
+            (members[0][self._label], colour, dots)
+            for members, colour, dots in mode_module(mode).layers(fills, **options)
+        ]
@@ -0,0 +1,337 @@
+import json
+import os
+from pathlib import Path
+import shutil
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+
+from .dots import MODES, mode_module
+
+
+# --------------------------------------------------
+# Queue layout
+# --------------------------------------------------
+# <root>/pending/<id>.json   jobs waiting for a worker
+# <root>/claimed/<id>.json   jobs being rendered (claimed by atomic rename)
+# <root>/leases/<id>.lease   touched by the worker while it renders
+#
+# A claimed job and its lease both hold the claim's token, so a worker
+# whose job was re-queued under it never touches a later claim.
+# <root>/done/<id>.json      status of finished jobs
+# <root>/failed/<id>.json    status of jobs that ran out of attempts
+# <root>/inputs/             copies of submitted input images
+# <root>/results/            rendered outputs
+STATES = ("pending", "claimed", "done", "failed")
+
+
+def _write_json(path, data):
+    # Write next to the target and rename over it, so readers never see a
+    # partially written file
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps(data, indent=2))
+    os.replace(tmp, path)
+
+
+def _changed(path):
+    # Renames update ctime but keep mtime, so use whichever is newer
+    st = path.stat()
+    return max(st.st_mtime, st.st_ctime)
+
+
+class WorkQueue:
+    """
+    A render queue kept in a directory on a shared filesystem.
+
+    Workers on any number of hosts claim jobs by atomically renaming them
+    from pending/ to claimed/, and keep a lease file fresh while they
+    render. A job whose lease has not been renewed for `lease` seconds is
+    assumed to belong to a dead worker and is put back in pending/, up to
+    `max_attempts` times in total.
+    """
+
+    def __init__(self, root, lease=60.0, max_attempts=3):
+        self.root = Path(root)
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        for name in STATES + ("leases", "inputs", "results"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state, job_id):
+        return self.root / state / f"{job_id}.json"
+
+    def _lease_path(self, job_id):
+        return self.root / "leases" / f"{job_id}.lease"
+
+    # -------------------------
+    # Producer side
+    # -------------------------
+    def submit(self, mode, output=None, input=None, **options):
+        """
+        Queue a render of `mode` and return its job id.
+
+        `options` are the keyword arguments of the mode's `generate()`
+        besides `img` and `output_path`, and must be JSON-serialisable.
+        `input` is copied into the queue, so it need not be on the shared
+        filesystem; without it the mode's default input is used. `output`
+        is the file name of the result in results/ (PNG by default).
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+
+        job_id = f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+
+        if input is not None:
+            copy = self.root / "inputs" / f"{job_id}{Path(input).suffix}"
+            shutil.copyfile(input, copy)
+            input = copy.name
+
+        job = {
+            "id": job_id,
+            "mode": mode,
+            "input": input,
+            "output": Path(output).name if output else f"{job_id}.png",
+            "options": options,
+            "attempts": 0,
+            "submitted": time.time(),
+        }
+        _write_json(self._path("pending", job_id), job)
+        return job_id
+
+    def status(self, job_id):
+        """Return the state of a job and its status record, or (None, None)."""
+        for state in STATES:
+            path = self._path(state, job_id)
+            try:
+                return state, json.loads(path.read_text())
+            except FileNotFoundError:
+                continue
+        return None, None
+
+    def counts(self):
+        return {state: len(list((self.root / state).glob("*.json"))) for state in STATES}
+
+    # -------------------------
+    # Worker side
+    # -------------------------
+    def claim(self, worker=None):
+        """
+        Claim the oldest pending job and return it, or None if there is none.
+        The job's `claim` token identifies this claim, by `worker` (the host
+        and process by default) and a random suffix.
+        """
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+
+        for path in sorted((self.root / "pending").glob("*.json")):
+            claimed = self.root / "claimed" / path.name
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Another worker got there first
+                continue
+
+            job = dict(json.loads(claimed.read_text()), claim=f"{worker}/{uuid.uuid4().hex}")
+            _write_json(self._lease_path(job["id"]), job["claim"])
+            _write_json(claimed, job)
+
+            if self._path("done", job["id"]).exists():
+                # Finished by a worker whose lease had expired
+                self._release(job)
+                continue
+
+            return job
+
+        return None
+
+    def _owns(self, job):
+        # Whether claimed/<id>.json is still this claim of the job
+        try:
+            return json.loads(self._path("claimed", job["id"]).read_text()).get("claim") == job["claim"]
+        except FileNotFoundError:
+            return False
+
+    def _lease_token(self, job_id):
+        try:
+            return json.loads(self._lease_path(job_id).read_text())
+        except FileNotFoundError:
+            return None
+
+    def _drop_lease(self, job):
+        if self._lease_token(job["id"]) == job.get("claim"):
+            self._lease_path(job["id"]).unlink(missing_ok=True)
+
+    def renew(self, job):
+        """
+        Refresh the lease of a claimed job. Returns False, without
+        recreating it, once the lease is gone or belongs to another claim.
+        """
+        if self._lease_token(job["id"]) != job["claim"]:
+            return False
+        try:
+            os.utime(self._lease_path(job["id"]))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _release(self, job):
+        if self._owns(job):
+            self._drop_lease(job)
+            self._path("claimed", job["id"]).unlink(missing_ok=True)
+
+    def complete(self, job, **info):
+        record = {k: v for k, v in job.items() if k != "claim"}
+        _write_json(self._path("done", job["id"]), dict(record, status="done", finished=time.time(), **info))
+        self._release(job)
+
+    def fail(self, job, error, claim=None, **info):
+        """
+        Record a failed attempt, re-queueing the job if it has attempts left.
+
+        The updated record is written over the claim (`claim`, by default
+        claimed/<id>.json) and renamed into pending/, so the job is in
+        exactly one state at every moment and a worker claiming it straight
+        away cannot lose its claim to this call. Without `claim`, nothing
+        is done, and False returned, if the job has since been re-queued
+        under another claim.
+        """
+        if claim is None:
+            if not self._owns(job):
+                return False
+            claim = self._path("claimed", job["id"])
+
+        token = job.get("claim")
+        job = {k: v for k, v in job.items() if k != "claim"}
+        job.update(attempts=job["attempts"] + 1, error=error)
+
+        # Drop the lease first: once renamed, the job may be claimed again
+        self._drop_lease(dict(job, claim=token))
+
+        if job["attempts"] < self.max_attempts:
+            _write_json(claim, job)
+            os.replace(claim, self._path("pending", job["id"]))
+        else:
+            _write_json(self._path("failed", job["id"]), dict(job, status="failed", finished=time.time(), **info))
+            Path(claim).unlink(missing_ok=True)
+
+        return True
+
+    def reap(self):
+        """Re-queue jobs whose lease has expired; return how many were found."""
+        now = time.time()
+        reaped = 0
+
+        for path in (self.root / "claimed").glob("*.json"):
+            job_id = path.stem
+            try:
+                lease = self._lease_path(job_id)
+                seen = _changed(lease) if lease.exists() else _changed(path)
+            except FileNotFoundError:
+                continue
+
+            if now - seen < self.lease:
+                continue
+
+            # Renaming the claim away first means only one reaper handles it
+            reaping = path.with_name(f".{path.name}.{uuid.uuid4().hex}.reap")
+            try:
+                os.rename(path, reaping)
+            except FileNotFoundError:
+                continue
+
+            job = json.loads(reaping.read_text())
+            self.fail(job, "lease expired", claim=reaping)
+            reaped += 1
+
+        return reaped
+
+    # -------------------------
+    # Rendering
+    # -------------------------
+    def render(self, job):
+        """Render a claimed job with its mode's generate() and return the output path."""
+        from .cli import load_default_image, load_image
+
+        if job["input"] is not None:
+            img = load_image(self.root / "inputs" / job["input"])
+        else:
+            img = load_default_image(job["mode"])
+
+        output = self.root / "results" / job["output"]
+        tmp = output.with_name(f".{uuid.uuid4().hex}{output.suffix}")
+
+        mode_module(job["mode"]).generate(
+            img=img,
+            output_path=tmp,
+            show=False,
+            **job["options"],
+        )
+        os.replace(tmp, output)
+        return output
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue, job):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        # Stop once the job has been re-queued under us
+        while not self.stopped.wait(self.queue.lease / 3):
+            if not self.queue.renew(self.job):
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# --------------------------------------------------
+# Worker loop
+# --------------------------------------------------
+def run_worker(root, lease=60.0, max_attempts=3, poll=1.0, max_jobs=None, exit_when_idle=False):
+    """
+    Claim and render jobs from the queue at `root` until stopped, until
+    `max_jobs` have been handled, or, with `exit_when_idle`, until the
+    queue has no pending or claimed jobs left.
+    """
+    queue = WorkQueue(root, lease=lease, max_attempts=max_attempts)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    handled = 0
+
+    print(f"Worker {worker} watching: {queue.root}")
+
+    while max_jobs is None or handled < max_jobs:
+        queue.reap()
+
+        job = queue.claim(worker)
+        if job is None:
+            counts = queue.counts()
+            if exit_when_idle and counts["pending"] == 0 and counts["claimed"] == 0:
+                break
+            time.sleep(poll)
+            continue
+
+        print(f"Rendering job: {job['id']} ({job['mode']})")
+        heartbeat = _Heartbeat(queue, job)
+        heartbeat.start()
+        start = time.time()
+
+        try:
+            output = queue.render(job)
+        except Exception:
+            heartbeat.stop()
+            queue.fail(job, traceback.format_exc(), worker=worker)
+            print(f"Job failed: {job['id']}")
+        else:
+            heartbeat.stop()
+            queue.complete(job, worker=worker, seconds=time.time() - start, result=str(output))
+
+        handled += 1
+
+    return handled
@@ -0,0 +1,51 @@
+import numpy as np
+from PIL import Image
+import pytest
+
+
+@pytest.fixture
+def dots():
+    """Dot parameters small enough to give every 48x48 stimulus a few dozen dots."""
+    return dict(radius=1.5, density=6, jitter=0.5, ratio=0.5, shape="circle")
+
+
+@pytest.fixture
+def mode_options(dots):
+    """The keyword arguments of each mode, with `dots` for every layer."""
+    def options(mode):
+        return {
+            "red-blue": dict(red_dots=dots, blue_dots=dots),
+            "red-green": dict(red_dots=dots, green_dots=dots),
+            "red-grey": dict(red_dots=dots, grey_dots=dots),
+            "flexible": dict(colour1="#FF0000", colour2="#0000FF", dots1=dots, dots2=dots),
+            "layered": dict(layers=[{"match": "red", "dots": dots}, {"match": "blue", "dots": dots}]),
+        }[mode]
+
+    return options
+
+
+@pytest.fixture
+def make_stimulus():
+    """
+    Build a 48x48 stimulus: a red square `offset` pixels from the top and a
+    blue square in the bottom right, on a `background` grey level.
+    """
+    def make(offset=4, background=0):
+        arr = np.full((48, 48, 3), background, dtype=np.uint8)
+        arr[offset:offset + 20, 4:24] = (255, 0, 0)
+        arr[26:44, 26:44] = (0, 0, 255)
+        return Image.fromarray(arr)
+
+    return make
+
+
+@pytest.fixture
+def stimulus(make_stimulus):
+    return make_stimulus()
+
+
+@pytest.fixture
+def stimulus_path(tmp_path, stimulus):
+    path = tmp_path / "stimulus.png"
+    stimulus.save(path)
+    return path
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from src.scripts.cache import RenderCache, request_key
+from src.scripts.dots import mode_module
+from src.scripts.vector import VectorImage
+
+
+def polygon_key(points, **options):
+    img = VectorImage([{"points": points, "fill": "#f00"}], (100, 100))
+    return request_key(RenderCache(), img, "red-blue", 1, "out.png", **options)
+
+
+def test_long_vector_geometry_is_keyed_in_full():
+    t = np.linspace(0, 2 * np.pi, 800, endpoint=False)
+    points = np.column_stack([50 + 40 * np.cos(t), 50 + 40 * np.sin(t)])
+    moved = points.copy()
+    moved[400] += 5
+
+    assert polygon_key(points) == polygon_key(points.tolist())
+    assert polygon_key(points) != polygon_key(moved)
+
+
+def test_options_without_a_plain_form_are_not_cached():
+    assert polygon_key([(10, 10), (90, 10), (50, 90)], red_dots=object()) is None
+
+
+@pytest.mark.parametrize("mode", ["red-blue", "red-green", "red-grey", "flexible", "layered"])
+def test_cached_render_is_restored_with_its_dots(tmp_path, make_stimulus, mode_options, mode):
+    img = make_stimulus(background=100)
+    generate = mode_module(mode).generate
+    options = mode_options(mode)
+
+    cache = RenderCache()
+    rendered = generate(img, tmp_path / "a.png", show=False, seed=1, cache=cache, return_index=True, **options)
+    restored = generate(img, tmp_path / "b.png", show=False, seed=1, cache=cache, return_index=True, **options)
+
+    assert cache.stats["hits"] == 1
+    assert (tmp_path / "a.png").read_bytes() == (tmp_path / "b.png").read_bytes()
+    assert np.array_equal(rendered.dots, restored.dots)
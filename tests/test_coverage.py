@@ -0,0 +1,18 @@
+import numpy as np
+from PIL import Image
+import pytest
+
+from src.scripts.coverage import recolour, render_coverage
+from src.scripts.dots import mode_module
+
+
+@pytest.mark.parametrize("mode", ["red-blue", "red-grey", "flexible"])
+def test_box_coverage_recolours_to_the_direct_render(tmp_path, make_stimulus, mode_options, mode):
+    img = make_stimulus(background=100)
+    options = mode_options(mode)
+
+    mode_module(mode).generate(img, tmp_path / "out.png", resample="box", show=False, seed=2, variant=1, **options)
+    coverage, colours = render_coverage(img, mode, resample="box", seed=2, variant=1, **options)
+
+    direct = np.asarray(Image.open(tmp_path / "out.png").convert("RGB"))
+    assert np.array_equal(np.asarray(recolour(coverage, colours)), direct)
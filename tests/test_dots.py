@@ -0,0 +1,92 @@
+import numpy as np
+from PIL import Image
+import pytest
+from scipy.ndimage import distance_transform_edt
+
+from src.scripts.dots import DIST_QUANTUM, CounterRNG, distance_field, iter_dots
+
+
+DOTS = dict(radius=2.5, density=7, jitter=1.3, ratio=0.5, shape="circle")
+
+MODES = {
+    "red-blue": dict(red_dots=DOTS, blue_dots=DOTS),
+    "flexible": dict(colour1="#FF0000", colour2="#0000FF", dots1=DOTS, dots2=DOTS),
+    "layered": dict(layers=[{"match": "red", "dots": DOTS}, {"match": (0, 0, 255), "dots": DOTS, "z": 1}]),
+}
+
+
+@pytest.fixture
+def stimulus():
+    rng = np.random.default_rng(0)
+    arr = np.zeros((130, 170, 3), dtype=np.uint8)
+    for _ in range(25):
+        y, x = rng.integers(0, 120), rng.integers(0, 160)
+        arr[y:y + rng.integers(5, 40), x:x + rng.integers(5, 40)] = [(255, 0, 0), (0, 0, 255)][rng.integers(2)]
+    return Image.fromarray(arr)
+
+
+def dots(img, mode, **kwargs):
+    return np.concatenate(list(iter_dots(img, mode, seed=5, **kwargs, **MODES[mode])))
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("order", ["scan", "tile"])
+def test_regions_partition_the_dots(stimulus, mode, order):
+    # Cuts off the cell grid, so cells straddle the region edges
+    regions = [(0, 0, 60.5, 45), (60.5, 0, 170, 45), (0, 45, 101, 130), (101, 45, 170, 130)]
+    parts = np.concatenate([dots(stimulus, mode, order=order, tile=3, region=r) for r in regions])
+
+    assert np.array_equal(np.sort(parts), np.sort(dots(stimulus, mode)))
+
+
+@pytest.fixture
+def drawn(monkeypatch):
+    # Number of cells in every call to CounterRNG.cell_uniforms
+    calls = []
+    cell_uniforms = CounterRNG.cell_uniforms
+
+    def record(self, layer, cells):
+        calls.append(len(cells))
+        return cell_uniforms(self, layer, cells)
+
+    monkeypatch.setattr(CounterRNG, "cell_uniforms", record)
+    return calls
+
+
+def test_region_draws_uniforms_for_its_cells_only(stimulus, drawn):
+    dots(stimulus, "red-blue", region=(14, 14, 35, 28))
+
+    # Cell columns 2-4 of rows 2 and 3, for each layer
+    assert drawn == [3, 3, 3, 3]
+
+
+@pytest.mark.parametrize("order, block", [("scan", 25), ("tile", 9)])
+def test_uniforms_are_drawn_one_block_at_a_time(stimulus, drawn, order, block):
+    dots(stimulus, "red-blue", order=order, tile=3)
+
+    # 19 x 25 cells per layer, drawn a row or a 3 x 3 tile at a time
+    assert max(drawn) == block
+    assert sum(drawn) == 2 * 19 * 25
+
+
+@pytest.mark.parametrize("tile", [1, 5, 16, 64])
+@pytest.mark.parametrize("cap", [1.5, 5.0, 9.3])
+def test_distance_field_is_exact_up_to_its_cap(tile, cap):
+    rng = np.random.default_rng(tile)
+
+    for density in (0.02, 0.5, 0.97):
+        mask = rng.random((70, 90)) > density
+        # Large all-True areas, some touching the image border
+        mask[10:50, 0:60] = True
+
+        expected = np.minimum(distance_transform_edt(mask), cap)
+        assert np.allclose(distance_field(mask, cap=cap, tile=tile), expected, atol=1e-6)
+
+        quantised = distance_field(mask, cap=min(cap, 255 * DIST_QUANTUM), tile=tile, quantise=True)
+        assert quantised.dtype == np.uint8
+        assert np.abs(quantised * DIST_QUANTUM - np.minimum(expected, 255 * DIST_QUANTUM)).max() <= DIST_QUANTUM / 2 + 1e-6
+
+
+def test_distance_field_of_uniform_masks():
+    assert not distance_field(np.zeros((30, 40), dtype=bool)).any()
+    assert (distance_field(np.ones((30, 40), dtype=bool), cap=3.0) == 3.0).all()
@@ -0,0 +1,59 @@
+import numpy as np
+from PIL import Image
+import pytest
+
+from src.scripts import layered
+from src.scripts.dots import RULES, CounterRNG, _dist_cap, _place_labelled, distance_field, mode_layers
+
+
+def test_image_without_matching_pixels_renders_blank(tmp_path, dots):
+    img = Image.new("RGB", (40, 40))
+
+    index = layered.generate(
+        img, tmp_path / "out.png", layers=[{"match": "red", "dots": dots}], show=False, seed=1, return_index=True
+    )
+
+    assert len(index) == 0
+    assert not np.asarray(Image.open(tmp_path / "out.png")).any()
+
+
+@pytest.mark.parametrize("mode, names", [
+    ("red-blue", ["blue", "red"]),
+    ("red-green", ["green", "red"]),
+    ("red-grey", ["grey", "red"]),
+])
+def test_named_rules_match_the_two_colour_modes(mode_options, mode, names):
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    # Near-greys and near-saturated colours, where the rules are tight
+    arr[:32] = np.clip(arr[:32, :, :1].astype(np.int16) + rng.integers(-6, 7, (32, 64, 3)), 0, 255)
+
+    expected = [(mask, colour) for mask, colour, _ in mode_layers(arr, mode, **mode_options(mode))]
+    ordered, label = layered.classify(arr, [{"match": name, "dots": None, "z": z} for z, name in enumerate(names)])
+
+    for i, (mask, colour) in enumerate(expected):
+        assert np.array_equal(label == i + 1, mask)
+        assert layered._resolve(ordered[i])[2] == colour
+
+
+def test_rules_do_not_wrap_around():
+    arr = np.array([[[255, 230, 230], [100, 102, 103]]], dtype=np.uint8)
+
+    assert not RULES["red"](arr)[0, 0]
+    assert RULES["grey"](arr)[0, 1]
+
+
+def test_placement_does_not_depend_on_the_band_size(stimulus, dots):
+    coarse = dict(dots, density=7, radius=2.5)
+    ordered, label = layered.classify(np.asarray(stimulus), [
+        {"match": "red", "dots": dots},
+        {"match": "blue", "dots": coarse, "z": 1},
+    ])
+    fields = [distance_field(label == i + 1, cap=_dist_cap(spec["dots"]["radius"])) for i, spec in enumerate(ordered)]
+    dots_list = [spec["dots"] for spec in ordered]
+
+    whole = _place_labelled(label, fields, dots_list, CounterRNG(3))
+    banded = _place_labelled(label, fields, dots_list, CounterRNG(3), band_pixels=1)
+
+    assert len(whole) > 0
+    assert np.array_equal(whole, banded)
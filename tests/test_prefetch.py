@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from src.scripts.prefetch import VariantPool
+from src.scripts.renderer import Renderer
+
+
+@pytest.fixture
+def options(mode_options):
+    return mode_options("red-blue")
+
+
+def test_fork_keeps_its_layers_when_the_parent_prepares_another_image(make_stimulus, options):
+    first, second = make_stimulus(2), make_stimulus(20)
+
+    parent = Renderer("red-blue", (48, 48), **options)
+    parent.prepare(first)
+    fork = parent.fork()
+    expected = np.asarray(Renderer("red-blue", (48, 48), **options).render(first, seed=1))
+
+    parent.prepare(second)
+
+    assert np.array_equal(np.asarray(fork.render(seed=1)), expected)
+
+
+def test_image_edited_in_place_is_prepared_again(make_stimulus, options):
+    img = make_stimulus(2)
+    renderer = Renderer("red-blue", (48, 48), **options)
+    renderer.prepare(img)
+
+    img.paste(make_stimulus(20))
+    expected = np.asarray(Renderer("red-blue", (48, 48), **options).render(make_stimulus(20), seed=1))
+
+    assert np.array_equal(np.asarray(renderer.render(img, seed=1)), expected)
+
+
+def test_pool_recovers_after_a_failed_render(monkeypatch, stimulus, options):
+    failures = [RuntimeError("render failed")]
+    render = VariantPool._render_in_thread
+
+    def flaky(self):
+        if failures:
+            raise failures.pop()
+        return render(self)
+
+    monkeypatch.setattr(VariantPool, "_render_in_thread", flaky)
+
+    with VariantPool(stimulus, "red-blue", size=2, processes=False, **options) as pool:
+        with pytest.raises(RuntimeError):
+            pool.get(timeout=30)
+        for _ in range(3):
+            assert pool.get(timeout=30).size == (48, 48)
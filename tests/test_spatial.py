@@ -0,0 +1,97 @@
+import numpy as np
+from PIL import Image, ImageDraw
+from scipy.ndimage import maximum_filter, minimum_filter
+import pytest
+
+from src.scripts import red_blue
+from src.scripts.dots import DOT_DTYPE
+from src.scripts.spatial import DotIndex
+
+
+@pytest.fixture
+def index(tmp_path, stimulus, dots):
+    # Overlapping circles and squares
+    return red_blue.generate(
+        stimulus,
+        tmp_path / "out.png",
+        red_dots=dict(dots, radius=3.0, density=4, jitter=1.0),
+        blue_dots=dict(dots, radius=3.0, density=4, jitter=1.0, shape="square"),
+        show=False,
+        seed=7,
+        return_index=True,
+    )
+
+
+@pytest.fixture
+def points():
+    return np.random.default_rng(0).uniform(-2, 50, (400, 2))
+
+
+def test_hit_matches_the_drawn_dots(index):
+    # Draw every dot in its own value, as the renderer does, at 8x
+    scale = 8
+    canvas = Image.new("I", (48 * scale, 48 * scale), 0)
+    draw = ImageDraw.Draw(canvas)
+    for i, dot in enumerate(index.dots):
+        x, y, r = dot["x"] * scale, dot["y"] * scale, dot["r"] * scale
+        if dot["square"]:
+            draw.rounded_rectangle((x - r, y - r, x + r, y + r), radius=0.25 * r, fill=i + 1)
+        else:
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=i + 1)
+    drawn = np.asarray(canvas) - 1
+
+    # Compare at raster pixel centres away from any outline; PIL draws
+    # shapes up to a pixel larger, both ends of their bounds included
+    settled = maximum_filter(drawn, size=5) == minimum_filter(drawn, size=5)
+    rows, cols = np.nonzero(settled)
+    found = index.hit(np.column_stack([cols + 0.5, rows + 0.5]) / scale)
+
+    assert (drawn >= 0).mean() > 0.2
+    assert np.array_equal(found, drawn[rows, cols])
+
+
+def test_nearest_matches_brute_force(index, points):
+    dist, found = index.nearest(points, layer=1)
+
+    red = np.flatnonzero(index.dots["layer"] == 1)
+    d = np.hypot(points[:, None, 0] - index.dots["x"][red], points[:, None, 1] - index.dots["y"][red])
+    assert np.allclose(dist, d.min(axis=1))
+    assert np.array_equal(found, red[d.argmin(axis=1)])
+
+
+@pytest.mark.parametrize("from_edge", [False, True])
+def test_within_radius_matches_brute_force(index, points, from_edge):
+    query, found = index.within_radius(points, 2.5, from_edge=from_edge)
+
+    d = np.hypot(points[:, None, 0] - index.dots["x"], points[:, None, 1] - index.dots["y"])
+    if from_edge:
+        d = d - index.dots["r"]
+    expected = set(zip(*np.nonzero(d <= 2.5)))
+
+    assert set(zip(query, found)) == expected
+
+
+def test_in_region_matches_brute_force(index):
+    found = index.in_region(10.5, 3, 30, 41.2, layer=0)
+
+    x, y = index.dots["x"], index.dots["y"]
+    inside = (x >= 10.5) & (x < 30) & (y >= 3) & (y < 41.2) & (index.dots["layer"] == 0)
+    assert np.array_equal(found, np.flatnonzero(inside))
+
+
+@pytest.mark.parametrize("empty, layer", [(True, None), (False, 5)])
+def test_empty_index(index, points, empty, layer):
+    # No dots at all, or none in the layer
+    if empty:
+        index = DotIndex(np.empty(0, dtype=DOT_DTYPE))
+
+    dist, found = index.nearest(points, k=2, layer=layer)
+    assert np.isinf(dist).all() and (found == -1).all()
+    assert all(len(a) == 0 for a in index.within_radius(points, 3, layer=layer, from_edge=True))
+    assert len(index.in_region(0, 0, 48, 48, layer=layer)) == 0
+    assert (index.hit(points, layer=layer) == -1).all()
+
+
+def test_index_round_trips_through_a_file(tmp_path, index):
+    index.save(tmp_path / "dots.npy")
+    assert np.array_equal(DotIndex.load(tmp_path / "dots.npy").dots, index.dots)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from src.scripts.vector import VectorImage, _edges, _rasterise, parse_path
+
+
+def filled(shapes, size=(20, 20)):
+    # Pixels covered by any shape
+    return np.asarray(VectorImage(shapes, size)).any(axis=2)
+
+
+def write_svg(tmp_path, body):
+    path = tmp_path / "stimulus.svg"
+    path.write_text(f'<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20">{body}</svg>')
+    return path
+
+
+# --------------------------------------------------
+# Rasterisation
+# --------------------------------------------------
+def test_rect_covers_the_pixels_whose_centres_it_contains():
+    expected = np.zeros((20, 20), dtype=bool)
+    expected[3:7, 2:7] = True
+
+    assert np.array_equal(filled([{"rect": (2, 3, 5, 4), "fill": "#f00"}]), expected)
+
+
+def test_circle_covers_the_pixels_whose_centres_it_contains():
+    mask = filled([{"circle": (10, 9.5, 6.3), "fill": "#f00"}])
+
+    y, x = np.mgrid[0:20, 0:20] + 0.5
+    d = np.hypot(x - 10, y - 9.5)
+    clear = np.abs(d - 6.3) > 0.05  # away from the flattened outline
+
+    assert np.array_equal(mask[clear], (d < 6.3)[clear])
+
+
+def test_subpaths_combine_with_the_even_odd_rule():
+    mask = filled([{"path": "M2 2 H18 V18 H2 Z M6 6 h8 v8 h-8 z", "fill": "#f00"}])
+
+    expected = np.zeros((20, 20), dtype=bool)
+    expected[2:18, 2:18] = True
+    expected[6:14, 6:14] = False
+
+    assert np.array_equal(mask, expected)
+
+
+def test_shapes_outside_the_image_rasterise_to_nothing():
+    edges = _edges([np.array([[-10.0, -10.0], [-2.0, -10.0], [-2.0, -2.0]])])
+    assert _rasterise(edges, 20, 20) is None
+
+
+def test_path_commands_give_the_same_polygon():
+    absolute, = parse_path("M1 1 L5 1 L5 5 L1 5 Z")
+    relative, = parse_path("m1 1 h4 v4 h-4 z")
+    assert np.allclose(absolute, relative)
+
+
+def test_curves_end_on_their_last_point():
+    curve, = parse_path("M0 0 Q5 10 10 0 C12 -5 15 5 20 0 Z", unit=4)
+    assert np.allclose(curve[-1], (20, 0))
+    assert len(curve) > 10
+
+
+# --------------------------------------------------
+# SVG files
+# --------------------------------------------------
+@pytest.mark.parametrize("body", [
+    '<rect x="2" y="2" width="10" height="10" style="stroke:none; fill: #ff0000 "/>',
+    '<rect x="2" y="2" width="10" height="10" fill="red"/>',
+    '<g fill="#f00"><g><rect x="2" y="2" width="10" height="10"/></g></g>',
+    '<g style="fill:blue"><rect x="2" y="2" width="10" height="10" fill="rgb(255, 0, 0)"/></g>',
+    '<g fill="red"><rect x="2" y="2" width="10" height="10" fill="inherit"/></g>',
+])
+def test_svg_fills_by_attribute_style_or_inheritance(tmp_path, body):
+    img = VectorImage.from_svg(write_svg(tmp_path, body))
+
+    assert tuple(np.asarray(img)[5, 5]) == (255, 0, 0)
+
+
+def test_svg_unfilled_and_undrawn_elements_are_skipped(tmp_path):
+    img = VectorImage.from_svg(write_svg(tmp_path, (
+        '<defs><rect id="a" width="20" height="20" fill="red"/></defs>'
+        '<g fill="none"><rect x="2" y="2" width="10" height="10"/></g>'
+    )))
+
+    assert img.shapes == []
+
+
+def test_svg_transforms_are_rejected_on_groups(tmp_path):
+    path = write_svg(tmp_path, '<g transform="scale(2)"><rect width="5" height="5" fill="red"/></g>')
+
+    with pytest.raises(ValueError, match="Transformed"):
+        VectorImage.from_svg(path)
+
+
+def test_unknown_colours_are_rejected():
+    with pytest.raises(ValueError, match="Unsupported fill colour"):
+        np.asarray(VectorImage([{"rect": (0, 0, 5, 5), "fill": "reddish"}], (10, 10)))
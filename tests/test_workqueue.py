@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from src.scripts import workqueue
+from src.scripts.workqueue import WorkQueue, run_worker
+
+
+@pytest.fixture
+def submit(stimulus_path, mode_options):
+    def submit(queue, **options):
+        return queue.submit("red-blue", input=stimulus_path, **mode_options("red-blue"), **options)
+
+    return submit
+
+
+def test_failed_job_is_never_lost_to_a_concurrent_claim(tmp_path, submit, monkeypatch):
+    a = WorkQueue(tmp_path / "queue", lease=60)
+    b = WorkQueue(tmp_path / "queue", lease=60)
+    job_id = submit(a)
+
+    job = a.claim()
+    claimed_by_b = []
+
+    # Worker B claims the job the moment it is back in pending/
+    replace = os.replace
+
+    def replace_then_claim(src, dst):
+        replace(src, dst)
+        if "pending" in str(dst):
+            claimed_by_b.append(b.claim())
+
+    monkeypatch.setattr(workqueue.os, "replace", replace_then_claim)
+    a.fail(job, "boom")
+    monkeypatch.undo()
+
+    assert claimed_by_b[0]["id"] == job_id
+    assert claimed_by_b[0]["attempts"] == 1
+    assert a.counts() == {"pending": 0, "claimed": 1, "done": 0, "failed": 0}
+    assert (tmp_path / "queue" / "leases" / f"{job_id}.lease").exists()
+
+
+def test_expired_lease_is_requeued(tmp_path, submit):
+    queue = WorkQueue(tmp_path / "queue", lease=0.1)
+    job_id = submit(queue)
+
+    assert queue.claim()["id"] == job_id
+    time.sleep(0.2)
+
+    assert queue.reap() == 1
+    state, job = queue.status(job_id)
+    assert state == "pending"
+    assert job["attempts"] == 1
+    assert queue.counts()["claimed"] == 0
+
+
+@pytest.fixture
+def reclaimed(tmp_path, submit):
+    # A job claimed by worker A, reaped after its lease expired and claimed
+    # again by worker B
+    queue = WorkQueue(tmp_path / "queue", lease=0.1)
+    submit(queue)
+
+    stale = queue.claim("a")
+    time.sleep(0.2)
+    assert queue.reap() == 1
+    current = queue.claim("b")
+
+    return queue, stale, current
+
+
+def test_stale_worker_cannot_renew_or_recreate_a_lease(tmp_path, submit):
+    queue = WorkQueue(tmp_path / "queue", lease=0.1)
+    submit(queue)
+    job = queue.claim()
+    lease = queue._lease_path(job["id"])
+
+    assert queue.renew(job)
+    time.sleep(0.2)
+    queue.reap()
+
+    assert not queue.renew(job)
+    assert not lease.exists()
+
+
+def test_heartbeat_stops_once_the_lease_is_gone(tmp_path, submit):
+    queue = WorkQueue(tmp_path / "queue", lease=0.05)
+    submit(queue)
+    job = queue.claim()
+
+    heartbeat = workqueue._Heartbeat(queue, job)
+    heartbeat.start()
+    queue._lease_path(job["id"]).unlink()
+    heartbeat.join(timeout=5)
+
+    assert not heartbeat.is_alive()
+    assert not queue._lease_path(job["id"]).exists()
+
+
+def test_stale_worker_leaves_the_new_claim_alone(reclaimed):
+    queue, stale, current = reclaimed
+    lease = queue._lease_path(current["id"])
+
+    assert not queue.renew(stale)
+    assert not queue.fail(stale, "boom")
+    queue.complete(stale)
+
+    assert queue.counts()["claimed"] == 1
+    assert queue._owns(current)
+    assert queue.renew(current)
+    assert lease.exists()
+
+    queue.complete(current)
+    assert queue.counts() == {"pending": 0, "claimed": 0, "done": 1, "failed": 0}
+    assert not lease.exists()
+
+
+def test_several_worker_processes_render_every_job(tmp_path, submit):
+    root = tmp_path / "queue"
+    queue = WorkQueue(root, lease=1.0)
+    job_ids = [submit(queue, seed=seed) for seed in range(6)]
+
+    # One job is claimed by a worker that dies straight away
+    assert queue.claim() is not None
+
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=run_worker, args=(str(root),), kwargs=dict(lease=1.0, poll=0.05, exit_when_idle=True))
+        for _ in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=120)
+        assert worker.exitcode == 0
+
+    assert queue.counts() == {"pending": 0, "claimed": 0, "done": 6, "failed": 0}
+
+    # Results are named after their jobs, so none overwrote another
+    results = sorted(p.name for p in (root / "results").iterdir())
+    assert results == sorted(f"{job_id}.png" for job_id in job_ids)